@@ -10,9 +10,17 @@ import uuid
 
 from config import Config
 from models import Database
-from auth import Auth, login_required
+from resilience import UpstreamUnavailable
+from intake_history import IntakeHistory
+from onboarding import Onboarding
+from tally import find_user_id, extract_fields, map_intake_data
+from auth import Auth, login_required, admin_required
+from retrieval import RetrievalIndex, intake_query
+from cohort_analytics import CohortIndex, build_from_database, parse_filters
 from email_utils import mail, send_verification_email, send_welcome_email
 import os
+import threading
+import time
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -25,15 +33,30 @@ mail.init_app(app)
 # Initialize services
 auth = Auth()
 db = Database()
+history = IntakeHistory(db.supabase, db.guard)
+onboarding = Onboarding(db, Config.SECRET_KEY, Config.ONBOARDING_CLAIMS_MAX_AGE, history)
 
 # Store verification tokens temporarily (in production, use Redis or database)
 verification_tokens = {}
 
 
+@app.errorhandler(UpstreamUnavailable)
+def upstream_unavailable(e):
+    """Supabase is down and there was no fallback data for this request"""
+    print(f"Upstream unavailable: {e}")
+    message = 'Service temporarily unavailable, please try again shortly.'
+    if request.accept_mimetypes.best == 'application/json' or request.is_json:
+        return jsonify({'error': message}), 503
+    return message, 503
+
+
 @app.route('/')
 def index():
-    """Landing page or home based on auth status"""
+    """Landing page, intake form or home based on auth and onboarding status"""
     if 'user_id' in session:
+        claims = onboarding.state(session['user_id'])
+        if not claims['intake_completed']:
+            return redirect(url_for('tally_form'))
         return redirect(url_for('home'))
     return redirect(url_for('welcome'))
 
@@ -90,18 +113,28 @@ def verify_token():
             session["user_id"] = user_id
             session["email"] = user_email
 
-            if not db.get_user_profile(user_id):
-                db.create_user_profile(user_id, user_email)
+            # Reuse onboarding claims from an earlier login if still valid
+            claims = onboarding.read(user_id)
+            if claims is None or not claims['profile_exists']:
+                profile_exists = db.get_user_profile(user_id, columns=['id']) is not None
+                if not profile_exists:
+                    profile_exists = db.create_user_profile(user_id, user_email) is not None
 
-            intake_data = db.get_user_intake_data(user_id)
+                intake_data = db.get_user_intake_data(user_id, columns=['id'])
+                intake_version = onboarding.intake_version(user_id) if intake_data is not None else None
+                claims = onboarding.issue(user_id, profile_exists, intake_data is not None, intake_version)
 
-            if not intake_data:
+            if not claims['intake_completed']:
                 return jsonify({"success": True, "redirect": url_for('tally_form')})
             else:
                 return jsonify({"success": True, "redirect": url_for('home')})
         else:
             return jsonify({"success": False, "error": "Invalid user"})
             
+    except UpstreamUnavailable as e:
+        # Don't guess: a failed lookup must not look like a missing profile
+        print(f"Verification deferred, Supabase unavailable: {e}")
+        return jsonify({"success": False, "error": "Service temporarily unavailable, please try again."}), 503
     except Exception as e:
         print(f"Verification error: {e}")
         return jsonify({"success": False, "error": str(e)})
@@ -125,7 +158,7 @@ def home():
     profile = db.get_user_profile(user_id)
     intake_data = db.get_user_intake_data(user_id)
     
-    # Generate recommendations (hardcoded for now)
+    # Knowledge documents matching the user's answers (general list as fallback)
     recommendations = generate_recommendations(intake_data)
     
     return render_template('home.html', profile=profile, recommendations=recommendations)
@@ -137,13 +170,12 @@ def profile():
     user_id = session.get('user_id')
     profile = db.get_user_profile(user_id)
 
-    # Fetch all intake records (history)
-    intake_history = db.supabase.table('comprehensive_intake') \
-        .select('*') \
-        .eq('user_id', user_id) \
-        .order('created_at', desc=True) \
-        .execute() \
-        .data
+    # Fetch all intake versions (history), newest first
+    intake_history = history.list_versions(user_id)
+    if not intake_history:
+        # Users who submitted before versioning only have the current row
+        current = db.get_user_intake_data(user_id)
+        intake_history = [current] if current else []
 
     # Use the latest one for analysis (optional)
     latest_intake = intake_history[0] if intake_history else None
@@ -156,6 +188,23 @@ def profile():
         intake_history=intake_history
     )
 
+@app.route('/intake-history/diff')
+@login_required
+def intake_history_diff():
+    """Field-level changes between two of the user's intake versions"""
+    user_id = session.get('user_id')
+    from_version = request.args.get('from', type=int)
+    to_version = request.args.get('to', type=int)
+
+    if from_version is None or to_version is None:
+        return jsonify({'error': 'Both from and to versions are required'}), 400
+
+    changes = history.diff_versions(user_id, from_version, to_version)
+    if changes is None:
+        return jsonify({'error': 'Version not found'}), 404
+
+    return jsonify({'from': from_version, 'to': to_version, 'changes': changes})
+
 @app.route('/explore')
 @login_required
 def explore():
@@ -177,11 +226,6 @@ def tally_form():
     
     return render_template('tally_form.html', prefill_data=prefill_data)
 
-# Add this to your app.py file
-
-# Store recent webhook submissions in memory (or use Redis in production)
-recent_submissions = {}
-
 @app.route('/tally-webhook', methods=['POST'])
 def tally_webhook():
     """Handle Tally form submission webhook"""
@@ -189,26 +233,17 @@ def tally_webhook():
         data = request.json
            
         # Extract user_id from hidden fields
-        fields = data.get('data', {}).get('fields', [])
-        user_id = None
-           
-        for field in fields:
-            if field.get('key') == 'question_bdVV96_173643ff-973c-4990-b125-0fe255b0ab67':
-                user_id = field.get('value')
-                break
+        user_id = find_user_id(data)
            
         if not user_id:
             print("WARNING: No user_id found in webhook data")
             return jsonify({'error': 'Missing user_id'}), 400
            
         # Process and save the comprehensive intake data
-        process_tally_data(user_id, data)
+        intake_version = process_tally_data(user_id, data)
         
-        # Mark submission as complete for this user
-        recent_submissions[user_id] = {
-            'completed': True,
-            'timestamp': datetime.utcnow().isoformat()
-        }
+        # Mark submission as complete; the user's onboarding claims pick this up
+        onboarding.record_submission(user_id, intake_version)
            
         return jsonify({'status': 'success'}), 200
     except Exception as e:
@@ -224,21 +259,15 @@ def check_submission_status(user_id):
     if session.get('user_id') != user_id:
         return jsonify({'error': 'Unauthorized'}), 403
     
-    # Check if we have intake data for this user
-    intake_data = db.get_user_intake_data(user_id)
+    # Answered from the session claims or this process's webhook record when
+    # possible; otherwise the intake table is checked while the form is pending
+    claims = onboarding.state(user_id, recheck_incomplete=True)
     
-    if intake_data:
+    if claims['intake_completed']:
         return jsonify({
             'completed': True,
-            'has_intake_data': True
-        })
-    
-    # Check recent submissions
-    if user_id in recent_submissions:
-        return jsonify({
-            'completed': True,
-            'has_intake_data': False,
-            'processing': True
+            'has_intake_data': True,
+            'intake_version': claims['intake_version']
         })
     
     return jsonify({
@@ -248,85 +277,127 @@ def check_submission_status(user_id):
     
 
 
+# Cohort index over choice answers, persisted at COHORT_INDEX_PATH. It is
+# rebuilt in a background thread once older than COHORT_CACHE_SECONDS (or by
+# `python cohort_analytics.py build`); requests keep the previous index meanwhile.
+cohort_cache = {'index': None, 'mtime': None, 'building': False, 'next_build': 0}
+cohort_lock = threading.Lock()
+
+def rebuild_cohort_index():
+    try:
+        print("Rebuilding cohort index")
+        index = build_from_database(db, Config.TALLY_SCHEMA_PATH)
+        index.save(Config.COHORT_INDEX_PATH)
+        with cohort_lock:
+            cohort_cache['index'] = index
+            cohort_cache['mtime'] = os.path.getmtime(Config.COHORT_INDEX_PATH)
+        print(f"Cohort index rebuilt: {index.size} users")
+    except Exception as e:
+        print(f"Error rebuilding cohort index: {e}")
+    finally:
+        with cohort_lock:
+            cohort_cache['building'] = False
+
+def get_cohort_index():
+    """Current cohort index (None until the first build), starting a rebuild when stale"""
+    path = Config.COHORT_INDEX_PATH
+    with cohort_lock:
+        # Pick up an index saved by the CLI or another worker
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        if mtime is not None and mtime != cohort_cache['mtime']:
+            try:
+                cohort_cache['index'] = CohortIndex.load(path)
+                cohort_cache['mtime'] = mtime
+            except Exception as e:
+                print(f"Error loading cohort index: {e}")
+
+        stale = mtime is None or time.time() - mtime > Config.COHORT_CACHE_SECONDS
+        # next_build also spaces out retries after a failed build
+        if stale and not cohort_cache['building'] and time.time() >= cohort_cache['next_build']:
+            cohort_cache['building'] = True
+            cohort_cache['next_build'] = time.time() + Config.COHORT_CACHE_SECONDS
+            threading.Thread(target=rebuild_cohort_index, daemon=True).start()
+        return cohort_cache['index']
+
+@app.route('/admin/supabase-health')
+@admin_required
+def admin_supabase_health():
+    """Circuit breaker state and retry/timeout/fallback counters per table"""
+    return jsonify(db.guard.snapshot())
+
+@app.route('/admin/cohort')
+@admin_required
+def admin_cohort():
+    """Cohort counts over choice answers.
+
+    Query parameters (filters are field:option and may repeat):
+      require / exclude - filter the cohort, e.g. require=digestive_symptoms:Bloating
+      prevalence        - field to report option prevalence for
+      cooccurrence      - one or two comma-separated fields for a co-occurrence matrix
+    """
+    try:
+        require = parse_filters(request.args.getlist('require'))
+        exclude = parse_filters(request.args.getlist('exclude'))
+        index = get_cohort_index()
+        if index is None:
+            return jsonify({'error': 'Cohort index is being built, try again shortly'}), 503
+
+        response = {
+            'total_users': index.size,
+            'matching_users': index.count(require, exclude),
+            'built_at': index.built_at
+        }
+
+        prevalence_field = request.args.get('prevalence')
+        if prevalence_field:
+            response['prevalence'] = {
+                option: {'count': count, 'share': share}
+                for option, (count, share) in index.prevalence(prevalence_field, require, exclude).items()
+            }
+
+        cooccurrence_fields = request.args.get('cooccurrence')
+        if cooccurrence_fields:
+            fields = cooccurrence_fields.split(',')
+            field_a = fields[0]
+            field_b = fields[1] if len(fields) > 1 else field_a
+            response['cooccurrence'] = {
+                'rows': index.dictionary.options[field_a],
+                'columns': index.dictionary.options[field_b],
+                'counts': index.cooccurrence(field_a, field_b, require, exclude).tolist()
+            }
+
+        return jsonify(response)
+    except (KeyError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+
 import uuid
 from datetime import datetime
 
 def process_tally_data(user_id, tally_data):
-    """Process and save Tally form data to comprehensive_intake table"""
+    """Process and save Tally form data to comprehensive_intake table.
+
+    Returns the intake version recorded for this submission.
+    """
     print("=" * 60)
     print("PROCESSING TALLY WEBHOOK DATA")
     print("=" * 60)
     print(f"Raw webhook payload: {json.dumps(tally_data, indent=2)}")
     
     try:
-        # Extract fields from the nested data structure
         fields_array = tally_data.get('data', {}).get('fields', [])
         
         print(f"\nProcessing {len(fields_array)} fields for user {user_id}")
         
-        # Build a dictionary mapping field keys to their values
-        fields_dict = {}
-        
-        if isinstance(fields_array, list):
-            for field in fields_array:
-                key = field.get('key')
-                value = field.get('value')
-                label = field.get('label')
-                
-                print(f"Field: {key} | Label: {label} | Value: {value}")
-                
-                if key:
-                    # Handle multiple choice - extract the selected option text
-                    if isinstance(value, list) and len(value) > 0:
-                        # Get the options array
-                        options = field.get('options', [])
-                        selected_ids = value
-                        
-                        # Map selected IDs to their text values
-                        selected_texts = []
-                        for opt in options:
-                            if opt.get('id') in selected_ids:
-                                selected_texts.append(opt.get('text'))
-                        
-                        fields_dict[key] = selected_texts if len(selected_texts) > 1 else (selected_texts[0] if selected_texts else None)
-                    else:
-                        fields_dict[key] = value
+        # Map selected option ids to their text values
+        fields_dict = extract_fields(tally_data)
         
         print(f"\nProcessed fields dictionary:")
         for k, v in fields_dict.items():
             print(f"  {k}: {v}")
         
-        # Map Tally field keys to database columns based on actual webhook structure
-        intake_data = {
-            'user_id': user_id,
-            'preferred_name': fields_dict.get('question_d9ONWo'),  # "First things first, what would you like us to call you?"
-            'birthday': fields_dict.get('question_Y41R5B'),  # "When's your birthday?"
-            'location': fields_dict.get('question_D7jK4R'),  # "Where are you living?"
-            'biological_sex': fields_dict.get('question_l6xqbk'),  # "What's your biological sex?"
-            'goals': fields_dict.get('question_RDAdG9'),  # "What do you hope to get out of Ruta?"
-            'chronic_conditions': fields_dict.get('question_o2qDbP'),  # "Do you have any chronic conditions?"
-            'medications_supplements': fields_dict.get('question_GRZKxZ'),  # "Are you taking any meds or supplements?"
-            'pregnancy_status': fields_dict.get('question_O76lDR'),  # "Are you pregnant, breastfeeding, or planning to be?"
-            'has_menstrual_cycle': fields_dict.get('question_VzKjLg'),  # "Do you have a menstrual cycle?"
-            'menstrual_symptoms': fields_dict.get('question_Pz7DdV'),  # "Do you experience any of the following related to your menstrual cycle?"
-            'bowel_movement_frequency': fields_dict.get('question_Ex25k4'),  # "How often do you have a bowel movement?"
-            'bowel_movement_type': fields_dict.get('question_roeBjN'),  # "How would you describe your bowel movements?"
-            'digestive_symptoms': fields_dict.get('question_4KMBaX'),  # "Do you notice any of the following related to your digestion?"
-            'other_symptoms': fields_dict.get('question_jljbea'),  # "Do you experience any other symptoms?"
-            'body_temperature': fields_dict.get('question_2KpBjj'),  # "How does your body temperature run?"
-            'nervous_system_signals': fields_dict.get('question_xJAjVr'),  # "Do you notice any of these nervous system signals?"
-            'energy_pattern': fields_dict.get('question_RDAdWd'),  # "How's your energy throughout the day?"
-            'sleep_pattern': fields_dict.get('question_o2qD9e'),  # "How's your sleep?"
-            'movement_level': fields_dict.get('question_GRZKep'),  # "What does your daily movement look like?"
-            'appetite_pattern': fields_dict.get('question_O76lQ7'),  # "How's your appetite lately?"
-            'diet_type': fields_dict.get('question_VzKjpJ'),  # "Do you eat according to a specific diet?"
-            'food_allergies': fields_dict.get('question_Pz7DR5'),  # "Do you have any food allergies or intolerances?"
-            'emotional_patterns': fields_dict.get('question_Ex25qX'),  # "Do you experience any of these emotional or stress patterns?"
-            'birth_history': fields_dict.get('question_roeBDl'),  # "What's your birth history?"
-            'past_medications': fields_dict.get('question_4KMBak'),  # "Have you ever taken any of these in the past?"
-            'significant_history': fields_dict.get('question_jljbex'),  # "Do you have a history of any of the following?"
-            'updated_at': datetime.utcnow().isoformat()
-        }
+        # Map Tally field keys to database columns (see tally.INTAKE_QUESTION_KEYS)
+        intake_data = map_intake_data(user_id, fields_dict)
         
         print("\n" + "=" * 60)
         print("MAPPED INTAKE DATA")
@@ -334,22 +405,17 @@ def process_tally_data(user_id, tally_data):
         for key, value in intake_data.items():
             print(f"{key}: {value}")
         
-        # Check if user already has intake data
-        existing = db.get_user_intake_data(user_id)
-        
-        if existing:
-            print(f"\n✓ Updating existing intake data for user {user_id}")
-            result = db.supabase.table('comprehensive_intake').update(intake_data).eq('user_id', user_id).execute()
-        else:
-            print(f"\n✓ Creating new intake data for user {user_id}")
-            intake_data['id'] = str(uuid.uuid4())
-            intake_data['created_at'] = datetime.utcnow().isoformat()
-            result = db.supabase.table('comprehensive_intake').insert(intake_data).execute()
+        # Insert or update the user's intake row (and the local replica)
+        result = db.save_intake_data(user_id, intake_data)
         
         print(f"\n✓ Database operation successful!")
         print(f"Result: {result}")
         print("=" * 60)
 
+        # Append this submission to the user's intake version log
+        version = history.record_version(user_id, intake_data)
+        print(f"\n✓ Recorded intake version {version} for user {user_id}")
+
         # ✅ NEW STEP: Update user's profile.full_name with preferred_name (if available)
         preferred_name = intake_data.get('preferred_name')
         if preferred_name:
@@ -357,6 +423,8 @@ def process_tally_data(user_id, tally_data):
             db.update_user_profile(user_id, {'full_name': preferred_name})
         else:
             print(f"\n⚠️ No preferred_name found in intake_data, skipping profile update")
+
+        return version
         
     except Exception as e:
         print(f"\n✗ ERROR in process_tally_data: {e}")
@@ -366,11 +434,47 @@ def process_tally_data(user_id, tally_data):
 
 
 
+# Knowledge retrieval index, opened on first use. It is built by the deploy
+# step (`python retrieval.py build ...`), never from a request.
+retrieval_index = None
+retrieval_next_attempt = 0
+
+# Seconds between attempts to open a missing or broken index
+RETRIEVAL_RETRY_SECONDS = 60
+
+def get_retrieval_index():
+    global retrieval_index, retrieval_next_attempt
+    if retrieval_index is None and time.time() >= retrieval_next_attempt:
+        retrieval_next_attempt = time.time() + RETRIEVAL_RETRY_SECONDS
+        try:
+            if os.path.exists(os.path.join(Config.RETRIEVAL_INDEX_PATH, 'manifest.json')):
+                retrieval_index = RetrievalIndex(Config.RETRIEVAL_INDEX_PATH)
+            else:
+                print(f"No retrieval index at {Config.RETRIEVAL_INDEX_PATH}; run "
+                      f"python retrieval.py build {Config.KNOWLEDGE_CORPUS_PATH} --index {Config.RETRIEVAL_INDEX_PATH}")
+        except Exception as e:
+            print(f"Error loading retrieval index: {e}")
+    return retrieval_index
+
 def generate_recommendations(intake_data):
     """Generate personalized recommendations based on intake data"""
-    # Hardcoded recommendations for now
-    # Later will be replaced with RAG chatbot
+    # Retrieve the knowledge documents that best match the user's answers
+    index = get_retrieval_index()
+    query = intake_query(intake_data) if intake_data else ''
+    if index is not None and query:
+        results = index.search(query, k=10)
+        if results:
+            return [
+                {
+                    'title': doc.get('title'),
+                    'category': doc.get('category'),
+                    'description': doc.get('description'),
+                    'icon': doc.get('icon', '🌱')
+                }
+                for _, doc in results
+            ]
     
+    # General recommendations when there is nothing to personalize on
     recommendations = [
         {
             'title': 'Morning Hydration Ritual',
@@ -1,5 +1,5 @@
 from functools import wraps
-from flask import session, redirect, url_for, flash
+from flask import session, redirect, url_for, flash, jsonify
 from supabase import create_client, Client
 from config import Config
 import secrets
@@ -75,6 +75,18 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def admin_required(f):
+    """Decorator for routes restricted to the emails listed in ADMIN_EMAILS"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            flash('Please log in to access this page.', 'warning')
+            return redirect(url_for('login'))
+        if (session.get('email') or '').lower() not in Config.ADMIN_EMAILS:
+            return jsonify({'error': 'Forbidden'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
 def generate_verification_token():
     """Generate a secure random token (not used by Supabase magic links)"""
     return secrets.token_urlsafe(32)
@@ -0,0 +1,326 @@
+"""
+Bulk backfill / replay of historical Tally submissions into comprehensive_intake.
+
+Reads a Tally export as a stream and maps every submission with the same
+code the webhook uses (tally.extract_fields / tally.map_intake_data). The
+mapped rows are written in chunked bulk upserts by a bounded pool of workers.
+
+Accepted inputs:
+  - JSON lines (.jsonl): one webhook payload per line, as Tally posts it
+  - CSV (.csv): one submission per row. Columns are matched to intake
+    columns by question title (as in Tally's CSV export), Tally question key
+    (question_xxx) or intake column name. Only the matched columns are
+    written. The user id comes from a `user_id` column or the hidden-field
+    key. Multi-select cells are split on ", ".
+
+Rows are stamped with the submission's own time (createdAt, or the CSV's
+"Submitted at"), and a submission older than the user's stored row is
+skipped, so replaying an old export never overwrites newer answers. Each
+written row is also appended to the user's intake version log.
+
+Progress is checkpointed as the number of input submissions fully written.
+Rerunning the same command resumes after them.
+
+Usage:
+    python backfill.py submissions.jsonl --dry-run
+    python backfill.py submissions.jsonl --chunk-size 250 --workers 4
+    python backfill.py export.csv
+
+Profile names and onboarding claims are left to the regular webhook path.
+"""
+
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from records import IntakeRecord, parse_timestamp
+from tally import (INTAKE_QUESTION_KEYS, INTAKE_QUESTION_LABELS, USER_ID_FIELD_KEY, extract_fields,
+                   find_user_id, map_intake_data)
+
+CSV_LIST_SEPARATOR = ', '
+
+# How often progress is printed, in submissions
+REPORT_EVERY = 10000
+
+
+def iter_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def stamp_submitted_at(record, value):
+    """Use the submission time as updated_at instead of the time of the replay"""
+    submitted_at = parse_timestamp(value)
+    if submitted_at is not None:
+        record['updated_at'] = submitted_at.isoformat()
+    return record
+
+
+def map_jsonl_submission(payload):
+    """Map one webhook payload to an IntakeRecord, or None without a user id"""
+    user_id = find_user_id(payload)
+    if not user_id:
+        return None
+    record = map_intake_data(user_id, extract_fields(payload))
+    data = payload.get('data', {})
+    record['tally_submission_id'] = data.get('submissionId') or payload.get('submissionId')
+    return stamp_submitted_at(record, data.get('createdAt') or payload.get('createdAt'))
+
+
+def normalize_label(text):
+    """Compare question titles ignoring case, spacing and curly quotes"""
+    text = text.replace('\u2019', "'").replace('\u2018', "'").replace('\u201c', '"').replace('\u201d', '"')
+    return ' '.join(text.lower().split())
+
+
+def csv_columns(header):
+    """Map CSV header cells to intake columns (or 'user_id'/'tally_submission_id'/'submitted_at')"""
+    columns_by_key = {key: column for column, key in INTAKE_QUESTION_KEYS.items()}
+    columns_by_label = {normalize_label(label): column for column, label in INTAKE_QUESTION_LABELS.items()}
+    mapping = {}
+    for cell in header:
+        name = cell.strip()
+        if normalize_label(name) in columns_by_label:
+            mapping[cell] = columns_by_label[normalize_label(name)]
+        elif name in ('user_id', USER_ID_FIELD_KEY):
+            mapping[cell] = 'user_id'
+        elif name in ('Submission ID', 'submission_id', 'tally_submission_id'):
+            mapping[cell] = 'tally_submission_id'
+        elif name in ('Submitted at', 'submitted_at'):
+            mapping[cell] = 'submitted_at'
+        elif name in columns_by_key:
+            mapping[cell] = columns_by_key[name]
+        elif name in INTAKE_QUESTION_KEYS:
+            mapping[cell] = name
+    return mapping
+
+
+def csv_value(column, cell):
+    """Empty cells are None; multi-select cells become a list, as from the webhook"""
+    if cell is None or cell == '':
+        return None
+    if IntakeRecord.COLUMNS.get(column) is list and CSV_LIST_SEPARATOR in cell:
+        return [part.strip() for part in cell.split(CSV_LIST_SEPARATOR) if part.strip()]
+    return cell
+
+
+def iter_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        mapping = csv_columns(reader.fieldnames or [])
+        if 'user_id' not in mapping.values():
+            raise SystemExit("CSV export needs a user_id column")
+        if not any(column in INTAKE_QUESTION_KEYS for column in mapping.values()):
+            raise SystemExit("CSV export has no columns matching the intake questions")
+        for row in reader:
+            yield {mapping[cell]: value for cell, value in row.items() if cell in mapping}
+
+
+def map_csv_submission(row):
+    user_id = row.get('user_id')
+    if not user_id:
+        return None
+    # Rebuild the question-keyed dict so the webhook mapping applies unchanged,
+    # limited to the questions the export contains
+    columns = [column for column in INTAKE_QUESTION_KEYS if column in row]
+    fields_dict = {INTAKE_QUESTION_KEYS[column]: csv_value(column, row[column]) for column in columns}
+    record = map_intake_data(user_id, fields_dict, columns)
+    if 'tally_submission_id' in row:
+        record['tally_submission_id'] = row['tally_submission_id'] or None
+    return stamp_submitted_at(record, row.get('submitted_at'))
+
+
+def read_submissions(path):
+    """Stream (submission, mapper) pairs from a JSON lines or CSV export"""
+    if path.endswith('.csv'):
+        return iter_csv(path), map_csv_submission
+    return iter_jsonl(path), map_jsonl_submission
+
+
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path) as f:
+            return json.load(f)['position']
+
+    def save(self, position):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'position': position}, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Progress:
+    """Tracks completed chunks and checkpoints the contiguous position safe to resume from"""
+
+    def __init__(self, start, checkpoint=None):
+        self.position = start
+        self.written = 0
+        # Submissions older than the user's stored row
+        self.outdated = 0
+        self.failed = None
+        self.checkpoint = checkpoint
+        self._done = {}
+        self._lock = threading.Lock()
+
+    def chunk_done(self, chunk_start, chunk_end, written, outdated=0):
+        with self._lock:
+            self._done[chunk_start] = chunk_end
+            self.written += written
+            self.outdated += outdated
+            # Only advance past chunks whose predecessors are all written
+            advanced = self.position in self._done
+            while self.position in self._done:
+                self.position = self._done.pop(self.position)
+            if advanced and self.checkpoint is not None:
+                self.checkpoint.save(self.position)
+
+
+def latest_by_user(records):
+    """A user may appear several times; keep their latest submission (ties: the later line)"""
+    latest = {}
+    for record in records:
+        submitted_at = parse_timestamp(record.get('updated_at'))
+        current = latest.get(record.user_id)
+        if current is None or current[0] is None or (submitted_at is not None and submitted_at >= current[0]):
+            latest[record.user_id] = (submitted_at, record)
+    return [record for _, record in latest.values()]
+
+
+def backfill(db, path, chunk_size=250, workers=4, dry_run=False, checkpoint_path=None, history=None):
+    """Replay an export into comprehensive_intake; returns the number of rows written.
+
+    With an IntakeHistory, every written row is appended to the user's version
+    log, one read and one bulk insert per chunk.
+    """
+    checkpoint = Checkpoint(checkpoint_path or f"{path}.checkpoint.json")
+    start = 0 if dry_run else checkpoint.load()
+    if start:
+        print(f"Resuming after {start} submissions")
+
+    submissions, mapper = read_submissions(path)
+    progress = Progress(start, None if dry_run else checkpoint)
+    # Bound in-flight chunks so parsing never runs far ahead of the writers
+    slots = threading.Semaphore(workers * 2)
+    pool = ThreadPoolExecutor(max_workers=workers)
+
+    def write_chunk(chunk_start, chunk_end, records):
+        try:
+            if progress.failed is None:
+                latest = latest_by_user(records)
+                written = db.bulk_upsert_intake(latest)
+                if history is not None and written:
+                    # Log the mapped answers, not the returned rows, in one bulk insert
+                    written_users = {row['user_id'] for row in written}
+                    history.record_versions([
+                        (record.user_id, record, record.get('updated_at'))
+                        for record in latest if record.user_id in written_users
+                    ])
+                progress.chunk_done(chunk_start, chunk_end, len(written), len(latest) - len(written))
+        except Exception as e:
+            progress.failed = e
+            print(f"Chunk {chunk_start}-{chunk_end} failed: {e}")
+        finally:
+            slots.release()
+
+    read = mapped = skipped = 0
+    chunk, chunk_start = [], start
+    # (future, user ids) of chunks that may still be writing
+    in_flight = []
+    started = time.monotonic()
+
+    def submit(chunk_end):
+        if dry_run:
+            return
+        users = {record.user_id for record in chunk}
+        # Let an earlier chunk with the same users land first, so a user's
+        # latest submission is also the last one written
+        in_flight[:] = [(future, chunk_users) for future, chunk_users in in_flight if not future.done()]
+        wait([future for future, chunk_users in in_flight if chunk_users & users])
+        slots.acquire()
+        in_flight.append((pool.submit(write_chunk, chunk_start, chunk_end, chunk), users))
+
+    for position, submission in enumerate(submissions):
+        if position < start:
+            continue
+        if progress.failed is not None:
+            break
+        read += 1
+        record = mapper(submission)
+        if record is None:
+            skipped += 1
+        else:
+            mapped += 1
+            chunk.append(record)
+
+        if len(chunk) >= chunk_size:
+            submit(position + 1)
+            chunk, chunk_start = [], position + 1
+
+        if read % REPORT_EVERY == 0:
+            elapsed = time.monotonic() - started
+            print(f"  {read} read, {progress.written} written ({read / elapsed:.0f} submissions/s)")
+
+    if progress.failed is None:
+        end = start + read
+        if chunk:
+            submit(end)
+        elif chunk_start < end and not dry_run:
+            # Only skipped submissions since the last chunk
+            progress.chunk_done(chunk_start, end, 0)
+
+    pool.shutdown(wait=True)
+    elapsed = time.monotonic() - started
+    rate = read / elapsed if elapsed else 0
+
+    print(f"{'Dry run' if dry_run else 'Backfill'} {'stopped' if progress.failed else 'complete'}: "
+          f"{read} read, {mapped} mapped, {skipped} skipped (no user id), "
+          f"{progress.written} rows written, {progress.outdated} older than the stored row, "
+          f"in {elapsed:.1f}s ({rate:.0f} submissions/s)")
+
+    if progress.failed is not None:
+        checkpoint.save(progress.position)
+        raise SystemExit(f"Stopped at submission {progress.position}; rerun to resume")
+    if not dry_run:
+        checkpoint.clear()
+    return progress.written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay Tally submissions into comprehensive_intake")
+    parser.add_argument('path', help="Tally export: .jsonl of webhook payloads or .csv")
+    parser.add_argument('--chunk-size', type=int, default=250,
+                        help="Rows per bulk upsert (user ids go in the URL, keep it modest)")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--dry-run', action='store_true', help="Parse and map only, write nothing")
+    parser.add_argument('--checkpoint', help="Checkpoint file (default: <path>.checkpoint.json)")
+    args = parser.parse_args()
+
+    db = history = None
+    if not args.dry_run:
+        from intake_history import IntakeHistory
+        from models import Database
+        db = Database()
+        history = IntakeHistory(db.supabase, db.guard)
+
+    backfill(db, args.path, chunk_size=args.chunk_size, workers=args.workers,
+             dry_run=args.dry_run, checkpoint_path=args.checkpoint, history=history)
+
+
+if __name__ == '__main__':
+    main()
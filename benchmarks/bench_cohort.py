@@ -0,0 +1,80 @@
+"""
+Cohort analytics on synthetic users.
+
+    python benchmarks/bench_cohort.py --users 1000000 --budget-mb 128
+
+Rows are generated lazily, so the reported peak is the memory of the
+encoding itself. Exits non-zero if the peak exceeds the budget.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cohort_analytics import COHORT_FIELDS, CohortIndex, OptionDictionary
+
+
+def synthetic_options():
+    return {field: [f"{field} option {i}" for i in range(random.Random(field).randint(4, 24))]
+            for field in COHORT_FIELDS}
+
+
+def synthetic_rows(options, n_users, seed=0, pool_size=4096):
+    """Cycle through a pool of random answer sets; generating each row fresh would dominate the timing"""
+    rng = random.Random(seed)
+    pool = []
+    for _ in range(pool_size):
+        answers = {}
+        for field, texts in options.items():
+            picked = rng.sample(texts, rng.randint(0, 3))
+            answers[field] = picked if len(picked) > 1 else (picked[0] if picked else None)
+        pool.append(answers)
+    for i in range(n_users):
+        yield pool[rng.randrange(pool_size)]
+
+
+def timed(label, fn):
+    started = time.perf_counter()
+    result = fn()
+    print(f"{label:<40} {(time.perf_counter() - started) * 1000:9.1f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--budget-mb', type=float, default=128)
+    args = parser.parse_args()
+
+    options = synthetic_options()
+    dictionary = OptionDictionary(options)
+    a, b = COHORT_FIELDS[0], COHORT_FIELDS[8]
+    bloating, poor_sleep = options[a][0], options[b][1]
+
+    tracemalloc.start()
+    index = timed(f"build ({args.users} users)", lambda: CohortIndex.build(dictionary, synthetic_rows(options, args.users)))
+    _, build_peak = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+
+    timed("count (2 required options)", lambda: index.count(require=[(a, bloating), (b, poor_sleep)]))
+    timed("prevalence (1 field)", lambda: index.prevalence(a))
+    timed("prevalence (filtered cohort)", lambda: index.prevalence(a, require=[(b, poor_sleep)]))
+    timed("co-occurrence (field x itself)", lambda: index.cooccurrence(a))
+    timed("co-occurrence (field x field)", lambda: index.cooccurrence(a, COHORT_FIELDS[2]))
+    _, query_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    peak_mb = max(build_peak, query_peak) / 2**20
+    print(f"index size: {index.nbytes() / 2**20:.1f} MB, "
+          f"peak traced memory: {peak_mb:.1f} MB (budget {args.budget_mb:.0f} MB)")
+    if peak_mb > args.budget_mb:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
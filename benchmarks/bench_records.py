@@ -0,0 +1,54 @@
+"""
+Memory of intake rows held as dicts vs IntakeRecord.
+
+    python benchmarks/bench_records.py --rows 100000
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from records import IntakeRecord
+
+
+def synthetic_row(i):
+    row = {}
+    for column, kind in IntakeRecord.COLUMNS.items():
+        # Small pool of values, as in real answers; only containers are per row
+        row[column] = [f"option {i % 7}", f"option {i % 5}"] if kind is list else f"{column} {i % 50}"
+    row['id'] = f"intake-{i}"
+    row['user_id'] = f"user-{i}"
+    return row
+
+
+def measure(label, build):
+    tracemalloc.start()
+    started = time.perf_counter()
+    rows = build()
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<32} {current / 2**20:8.1f} MB {elapsed * 1000:9.1f} ms")
+    return rows, current
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    source = [synthetic_row(i) for i in range(args.rows)]
+    print(f"{args.rows} rows x {len(IntakeRecord.COLUMNS)} columns")
+
+    # Copies, as each Supabase page hands us freshly decoded dicts
+    _, dict_bytes = measure("dicts", lambda: [dict(row) for row in source])
+    _, record_bytes = measure("IntakeRecord.from_rows", lambda: IntakeRecord.from_rows(source))
+    print(f"records use {record_bytes / dict_bytes:.0%} of the dict memory")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Retrieval index build time and query latency on a synthetic corpus.
+
+    python benchmarks/bench_retrieval.py --docs 100000
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from retrieval import RetrievalIndex
+
+
+def synthetic_docs(n_docs, vocab_size=50000, doc_length=80, seed=0, start=0):
+    """Documents with Zipf-distributed words, like natural text"""
+    rng = np.random.default_rng(seed)
+    words = [f"w{i}" for i in range(vocab_size)]
+    for i in range(start, start + n_docs):
+        ids = np.minimum(rng.zipf(1.3, size=doc_length), vocab_size) - 1
+        yield {
+            'id': f"doc-{i}",
+            'title': ' '.join(words[j] for j in ids[:6]),
+            'description': ' '.join(words[j] for j in ids[6:]),
+            'tags': [],
+        }
+
+
+def percentiles(samples):
+    samples = np.array(samples) * 1000
+    return f"p50 {np.percentile(samples, 50):7.2f} ms  p95 {np.percentile(samples, 95):7.2f} ms"
+
+
+def run_queries(index, queries):
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        index.search(query, k=10)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=500)
+    args = parser.parse_args()
+
+    path = tempfile.mkdtemp(prefix='retrieval-bench-')
+    try:
+        docs = list(synthetic_docs(args.docs))
+        started = time.perf_counter()
+        RetrievalIndex.build(path, docs)
+        print(f"build ({args.docs} docs)        {time.perf_counter() - started:8.2f} s")
+        del docs
+
+        started = time.perf_counter()
+        index = RetrievalIndex(path)
+        print(f"open (mmap)                {(time.perf_counter() - started) * 1000:8.2f} ms")
+
+        rng = np.random.default_rng(1)
+        # Mix of common and rare words, 3-8 terms per query
+        queries = [
+            ' '.join(f"w{j}" for j in rng.integers(0, 2000, size=rng.integers(3, 9)))
+            for _ in range(args.queries)
+        ]
+        print(f"query, uncached            {percentiles(run_queries(index, queries))}")
+        # Repeat queries that fit in the LRU cache
+        repeated = queries[:index.cache_size]
+        run_queries(index, repeated)
+        print(f"query, cached              {percentiles(run_queries(index, repeated))}")
+
+        started = time.perf_counter()
+        index.add(synthetic_docs(1000, seed=2, start=args.docs))
+        print(f"incremental add (1000)     {(time.perf_counter() - started) * 1000:8.2f} ms")
+        print(f"query, two segments        {percentiles(run_queries(index, queries[:100]))}")
+
+        started = time.perf_counter()
+        index.compact()
+        print(f"compact                    {time.perf_counter() - started:8.2f} s")
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
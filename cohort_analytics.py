@@ -0,0 +1,303 @@
+"""
+Cohort analytics over choice answers in comprehensive_intake.
+
+Each user's answers to a choice question are encoded as a fixed-width bitset
+(one bit per option in the Tally schema), stored in one NumPy array per
+question using the narrowest unsigned integer type that fits. 1M users with
+a dozen questions take a few tens of MB, and every query is a handful of
+vectorized passes over those arrays:
+
+    index = CohortIndex.build(OptionDictionary.from_tally_payload(payload), rows)
+    index.count(require=[('digestive_symptoms', 'Bloating'),
+                         ('sleep_pattern', 'Poor sleep')])
+    index.prevalence('digestive_symptoms')
+    index.cooccurrence('digestive_symptoms', 'emotional_patterns')
+
+Building from Supabase pages through the whole table, so it is done off the
+request path and the arrays are saved to a single .npz file:
+
+    python cohort_analytics.py build [--output cohort_index.npz]
+"""
+
+import argparse
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+
+from tally import option_schema
+
+# Choice questions encoded by default
+COHORT_FIELDS = (
+    'digestive_symptoms',
+    'nervous_system_signals',
+    'emotional_patterns',
+    'significant_history',
+    'menstrual_symptoms',
+    'other_symptoms',
+    'past_medications',
+    'goals',
+    'sleep_pattern',
+    'energy_pattern',
+    'body_temperature',
+    'bowel_movement_type',
+)
+
+MAX_OPTIONS = 64
+
+# Distinct answers per field whose bitsets are memoized while building
+MEMO_SIZE = 65536
+
+# Rows expanded to a dense 0/1 matrix at a time when computing co-occurrence
+COOCCURRENCE_CHUNK = 65536
+
+
+def _as_options(value):
+    """Answers are stored as a list, a single option text, or None"""
+    if value is None:
+        return ()
+    if isinstance(value, (list, tuple)):
+        return value
+    return (value,)
+
+
+def _dtype_for(n_options):
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if n_options <= np.dtype(dtype).itemsize * 8:
+            return dtype
+    raise ValueError(f"At most {MAX_OPTIONS} options per field are supported")
+
+
+class OptionDictionary:
+    """Fixed option -> bit position mapping for each encoded field"""
+
+    def __init__(self, options):
+        self.options = {}
+        self.positions = {}
+        for field, texts in options.items():
+            texts = list(dict.fromkeys(t for t in texts if t is not None))
+            if len(texts) > MAX_OPTIONS:
+                raise ValueError(f"Field {field} has {len(texts)} options; at most {MAX_OPTIONS} are supported")
+            self.options[field] = texts
+            self.positions[field] = {text: i for i, text in enumerate(texts)}
+
+    @classmethod
+    def from_tally_payload(cls, tally_data, fields=COHORT_FIELDS):
+        """Build from the option lists in a Tally webhook payload"""
+        schema = option_schema(tally_data)
+        return cls({field: schema[field] for field in fields if field in schema})
+
+    @classmethod
+    def from_rows(cls, rows, fields=COHORT_FIELDS):
+        """Build from the answers seen in intake rows, when no schema is at hand"""
+        seen = {field: {} for field in fields}
+        for row in rows:
+            for field in fields:
+                for option in _as_options(row.get(field)):
+                    seen[field][option] = None
+        return cls({field: list(options) for field, options in seen.items() if options})
+
+    def fields(self):
+        return list(self.options)
+
+    def bit(self, field, option):
+        try:
+            return self.positions[field][option]
+        except KeyError:
+            raise KeyError(f"Unknown option {option!r} for field {field!r}")
+
+    def encode(self, field, value):
+        """Bitset (as a Python int) for one user's answer; unknown options are ignored"""
+        positions = self.positions[field]
+        bits = 0
+        for option in _as_options(value):
+            position = positions.get(option)
+            if position is not None:
+                bits |= 1 << position
+        return bits
+
+
+class CohortIndex:
+    def __init__(self, dictionary, bitsets, user_ids=None, built_at=None):
+        self.dictionary = dictionary
+        self.bitsets = bitsets
+        self.user_ids = user_ids
+        self.built_at = built_at
+        self.size = len(next(iter(bitsets.values()))) if bitsets else 0
+
+    @classmethod
+    def build(cls, dictionary, rows, chunk_size=65536, keep_user_ids=False):
+        """Encode an iterable of intake rows, holding at most one chunk of Python ints at a time"""
+        fields = dictionary.fields()
+        dtypes = {field: _dtype_for(len(dictionary.options[field])) for field in fields}
+        chunks = {field: [] for field in fields}
+        pending = {field: [] for field in fields}
+        user_ids = [] if keep_user_ids else None
+
+        def flush():
+            for field in fields:
+                chunks[field].append(np.array(pending[field], dtype=dtypes[field]))
+                pending[field].clear()
+
+        # Most users pick from a small set of answer combinations, so memoize
+        # their encodings instead of re-walking the option list every row
+        memo = {field: {} for field in fields}
+
+        def encode(field, value):
+            key = tuple(value) if isinstance(value, list) else value
+            field_memo = memo[field]
+            bits = field_memo.get(key)
+            if bits is None:
+                bits = dictionary.encode(field, value)
+                if len(field_memo) < MEMO_SIZE:
+                    field_memo[key] = bits
+            return bits
+
+        count = 0
+        for row in rows:
+            for field in fields:
+                pending[field].append(encode(field, row.get(field)))
+            if keep_user_ids:
+                user_ids.append(row.get('user_id'))
+            count += 1
+            if count % chunk_size == 0:
+                flush()
+        flush()
+
+        bitsets = {}
+        for field in fields:
+            bitsets[field] = np.concatenate(chunks[field])
+            chunks[field] = None
+        return cls(dictionary, bitsets, user_ids, built_at=datetime.utcnow().isoformat())
+
+    def save(self, path):
+        """Write the option dictionary and bitsets to one .npz file, replacing it atomically"""
+        meta = {'options': self.dictionary.options, 'built_at': self.built_at}
+        arrays = {f"bits_{field}": bits for field, bits in self.bitsets.items()}
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            bitsets = {name[len('bits_'):]: data[name] for name in data.files if name.startswith('bits_')}
+        return cls(OptionDictionary(meta['options']), bitsets, built_at=meta['built_at'])
+
+    def nbytes(self):
+        return sum(bits.nbytes for bits in self.bitsets.values())
+
+    def _option_mask(self, field, option):
+        bits = self.bitsets[field]
+        return bits.dtype.type(1 << self.dictionary.bit(field, option))
+
+    def mask(self, require=(), exclude=()):
+        """Boolean array of users having every required and none of the excluded (field, option) pairs"""
+        # Group by field so each field's array is scanned once
+        required, excluded = {}, {}
+        for target, pairs in ((required, require), (excluded, exclude)):
+            for field, option in pairs:
+                bit = self._option_mask(field, option)
+                target[field] = target.get(field, bit.dtype.type(0)) | bit
+
+        result = np.ones(self.size, dtype=bool)
+        for field, bits in required.items():
+            result &= (self.bitsets[field] & bits) == bits
+        for field, bits in excluded.items():
+            result &= (self.bitsets[field] & bits) == 0
+        return result
+
+    def count(self, require=(), exclude=()):
+        """Number of users matching a filter, e.g. bloating AND poor sleep"""
+        if not require and not exclude:
+            return self.size
+        return int(np.count_nonzero(self.mask(require, exclude)))
+
+    def prevalence(self, field, require=(), exclude=()):
+        """{option: (count, share)} within the users matching an optional filter"""
+        bits = self.bitsets[field]
+        if require or exclude:
+            bits = bits[self.mask(require, exclude)]
+        total = len(bits)
+        result = {}
+        for position, option in enumerate(self.dictionary.options[field]):
+            matched = int(np.count_nonzero(bits & bits.dtype.type(1 << position)))
+            result[option] = (matched, matched / total if total else 0.0)
+        return result
+
+    def _dense(self, field, start, stop, rows=None):
+        """0/1 float32 matrix (users x options) for a slice of users"""
+        bits = self.bitsets[field][start:stop]
+        if rows is not None:
+            bits = bits[rows[start:stop]]
+        n_options = len(self.dictionary.options[field])
+        shifts = np.arange(n_options, dtype=bits.dtype)
+        return ((bits[:, None] >> shifts) & 1).astype(np.float32)
+
+    def cooccurrence(self, field_a, field_b=None, require=(), exclude=()):
+        """Count matrix M[i, j] = users with option i of field_a and option j of field_b"""
+        field_b = field_b or field_a
+        rows = self.mask(require, exclude) if (require or exclude) else None
+        n_a = len(self.dictionary.options[field_a])
+        n_b = len(self.dictionary.options[field_b])
+        matrix = np.zeros((n_a, n_b), dtype=np.int64)
+
+        # Chunked so the dense expansion never exceeds COOCCURRENCE_CHUNK rows;
+        # per-chunk sums stay well below float32's exact integer range.
+        for start in range(0, self.size, COOCCURRENCE_CHUNK):
+            stop = start + COOCCURRENCE_CHUNK
+            dense_a = self._dense(field_a, start, stop, rows)
+            dense_b = dense_a if field_b == field_a else self._dense(field_b, start, stop, rows)
+            matrix += np.rint(dense_a.T @ dense_b).astype(np.int64)
+        return matrix
+
+
+def parse_filters(values):
+    """Parse 'field:option' strings from query parameters into (field, option) pairs"""
+    pairs = []
+    for value in values:
+        field, sep, option = value.partition(':')
+        if not sep or not field or not option:
+            raise ValueError(f"Filter {value!r} must look like field:option")
+        pairs.append((field, option))
+    return pairs
+
+
+def build_from_database(db, schema_path=None, fields=COHORT_FIELDS):
+    """Encode every intake row's choice answers into a CohortIndex"""
+    columns = ('id', 'user_id') + tuple(fields)
+
+    def rows():
+        for page in db.iter_table_pages('comprehensive_intake', columns=columns):
+            yield from page
+
+    if schema_path:
+        with open(schema_path) as f:
+            dictionary = OptionDictionary.from_tally_payload(json.load(f), fields)
+    else:
+        # Without a saved schema, learn the options from the data (extra pass)
+        dictionary = OptionDictionary.from_rows(rows(), fields)
+    return CohortIndex.build(dictionary, rows())
+
+
+def main():
+    from config import Config
+
+    parser = argparse.ArgumentParser(description="Build the cohort index from comprehensive_intake")
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--output', default=Config.COHORT_INDEX_PATH)
+    parser.add_argument('--schema', default=Config.TALLY_SCHEMA_PATH,
+                        help="Saved Tally webhook payload defining the options")
+    args = parser.parse_args()
+
+    from models import Database
+    index = build_from_database(Database(), args.schema)
+    index.save(args.output)
+    print(f"Encoded {index.size} users ({index.nbytes() / 1e6:.1f} MB) into {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -23,7 +23,36 @@ class Config:
     
     # Tally
     TALLY_WEBHOOK_URL = os.environ.get('TALLY_WEBHOOK_URL')
+    # A saved webhook payload; its option lists define the cohort bitsets
+    TALLY_SCHEMA_PATH = os.environ.get('TALLY_SCHEMA_PATH')
+    
+    # Knowledge corpus and the retrieval index built from it
+    KNOWLEDGE_CORPUS_PATH = os.environ.get('KNOWLEDGE_CORPUS_PATH', 'knowledge/corpus.jsonl')
+    RETRIEVAL_INDEX_PATH = os.environ.get('RETRIEVAL_INDEX_PATH', 'knowledge/index')
+    
+    # Admin
+    ADMIN_EMAILS = [e.strip().lower() for e in os.environ.get('ADMIN_EMAILS', '').split(',') if e.strip()]
+    COHORT_CACHE_SECONDS = int(os.environ.get('COHORT_CACHE_SECONDS', 600))
+    COHORT_INDEX_PATH = os.environ.get('COHORT_INDEX_PATH', 'cohort_index.npz')
+    
+    # Supabase call deadlines (seconds), retries and circuit breaking
+    SUPABASE_READ_TIMEOUT = float(os.environ.get('SUPABASE_READ_TIMEOUT', 2.0))
+    SUPABASE_WRITE_TIMEOUT = float(os.environ.get('SUPABASE_WRITE_TIMEOUT', 5.0))
+    SUPABASE_READ_RETRIES = int(os.environ.get('SUPABASE_READ_RETRIES', 2))
+    SUPABASE_HEDGE_DELAY = float(os.environ.get('SUPABASE_HEDGE_DELAY', 0.3))  # 0 disables hedged reads
+    SUPABASE_SCAN_TIMEOUT = float(os.environ.get('SUPABASE_SCAN_TIMEOUT', 30.0))  # per page of a bulk scan
+    # HTTP timeout of the client itself, so calls abandoned at their deadline
+    # do not hold a guard thread for the library default (~120 s)
+    SUPABASE_CLIENT_TIMEOUT = float(os.environ.get('SUPABASE_CLIENT_TIMEOUT', SUPABASE_WRITE_TIMEOUT))
+    SUPABASE_GUARD_WORKERS = int(os.environ.get('SUPABASE_GUARD_WORKERS', 16))
+    BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5))
+    BREAKER_RESET_SECONDS = float(os.environ.get('BREAKER_RESET_SECONDS', 30))
+    
+    # Local SQLite read replica (disabled unless a path is set)
+    REPLICA_PATH = os.environ.get('REPLICA_PATH')
+    REPLICA_MAX_STALENESS = int(os.environ.get('REPLICA_MAX_STALENESS', 300))
     
     # Session
+    ONBOARDING_CLAIMS_MAX_AGE = int(os.environ.get('ONBOARDING_CLAIMS_MAX_AGE', 900))
     SESSION_TYPE = 'filesystem'
     SESSION_PERMANENT = False
\ No newline at end of file
@@ -0,0 +1,225 @@
+"""
+Bulk export of the comprehensive_intake table to CSV or Parquet.
+
+Pages through the table with keyset cursors, so memory use stays constant no
+matter how large the table is. Multi-select answers (lists of option texts)
+are flattened to a single "; "-separated string.
+
+Progress is checkpointed after every page (CSV) or every finished part file
+(Parquet); rerunning the same command after an interruption resumes from the
+checkpoint.
+
+Usage:
+    python export_intake.py --format csv --output intake.csv
+    python export_intake.py --format parquet --output intake_parquet/
+
+Parquet output needs pyarrow, which is not part of requirements.txt:
+    pip install pyarrow
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+
+from models import Database
+
+LIST_SEPARATOR = '; '
+
+
+def flatten_value(value):
+    """Flatten a single column value into something a flat file can hold"""
+    if isinstance(value, list):
+        return LIST_SEPARATOR.join(str(v) for v in value if v is not None)
+    if isinstance(value, dict):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+def flatten_row(row, columns):
+    return [flatten_value(row.get(column)) for column in columns]
+
+
+class Checkpoint:
+    """Small JSON file recording how far an export got"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as f:
+            return json.load(f)
+
+    def save(self, state):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class CsvSink:
+    def __init__(self, path, state):
+        self.path = path
+        resuming = state.get('offset') is not None
+        self.file = open(path, 'r+' if resuming else 'w', newline='', encoding='utf-8')
+        if resuming:
+            # Drop anything written after the last checkpoint
+            self.file.seek(state['offset'])
+            self.file.truncate()
+        self.writer = csv.writer(self.file)
+        self.columns = state.get('columns')
+
+    def write_page(self, rows, state):
+        if self.columns is None:
+            self.columns = list(rows[0].keys())
+            state['columns'] = self.columns
+            self.writer.writerow(self.columns)
+        self.writer.writerows(flatten_row(row, self.columns) for row in rows)
+        self.file.flush()
+        state['offset'] = self.file.tell()
+        return True
+
+    def close(self, state):
+        self.file.close()
+
+
+class ParquetSink:
+    """Writes fixed-size part files, each made of one row group per page"""
+
+    def __init__(self, path, state, rows_per_part):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet export requires pyarrow: pip install pyarrow")
+        self.pa = pa
+        self.pq = pq
+        self.path = path
+        self.rows_per_part = rows_per_part
+        self.columns = state.get('columns')
+        self.schema = None
+        self.writer = None
+        self.part_rows = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _open_part(self, state):
+        part_path = os.path.join(self.path, f"part-{state.get('part', 0):05d}.parquet")
+        self.writer = self.pq.ParquetWriter(part_path, self.schema)
+        self.part_rows = 0
+
+    def _close_part(self, state):
+        self.writer.close()
+        self.writer = None
+        state['part'] = state.get('part', 0) + 1
+
+    def write_page(self, rows, state):
+        """Write a page; returns True once the rows are durable and can be checkpointed"""
+        if self.columns is None:
+            self.columns = list(rows[0].keys())
+            state['columns'] = self.columns
+        if self.schema is None:
+            # Every column is exported as text so part files always share one schema
+            self.schema = self.pa.schema([(c, self.pa.string()) for c in self.columns])
+        if self.writer is None:
+            self._open_part(state)
+
+        arrays = []
+        for column in self.columns:
+            values = [flatten_value(row.get(column)) for row in rows]
+            arrays.append(self.pa.array(
+                [None if v is None else str(v) for v in values],
+                type=self.pa.string()
+            ))
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+        self.part_rows += len(rows)
+
+        if self.part_rows >= self.rows_per_part:
+            self._close_part(state)
+            return True
+        return False
+
+    def close(self, state):
+        if self.writer is not None:
+            self._close_part(state)
+
+
+def export_intake(db, fmt, output, page_size=1000, rows_per_part=100000,
+                  checkpoint_path=None, table='comprehensive_intake'):
+    """Stream a table to CSV or Parquet, resuming from a checkpoint if one exists"""
+    checkpoint = Checkpoint(checkpoint_path or f"{output.rstrip(os.sep)}.checkpoint.json")
+    state = checkpoint.load()
+    if state and (state.get('format') != fmt or state.get('table') != table):
+        raise SystemExit(f"Checkpoint {checkpoint.path} belongs to a different export")
+    if state:
+        print(f"Resuming export after id {state['last_id']} ({state['rows']} rows done)")
+    else:
+        state = {'format': fmt, 'table': table, 'last_id': None, 'rows': 0}
+
+    if fmt == 'csv':
+        sink = CsvSink(output, state)
+    else:
+        sink = ParquetSink(output, state, rows_per_part)
+
+    # Rows written since the last checkpoint, not yet durable
+    pending_rows = 0
+    pending_last_id = None
+    started = time.monotonic()
+    exported = 0
+
+    # Raw rows, so columns not declared in records.SCHEMA are exported too
+    for page in db.iter_table_pages(table, page_size=page_size, after=state['last_id'], as_records=False):
+        durable = sink.write_page(page, state)
+        pending_rows += len(page)
+        pending_last_id = page[-1]['id']
+        exported += len(page)
+
+        if durable:
+            state['rows'] += pending_rows
+            state['last_id'] = pending_last_id
+            pending_rows = 0
+            checkpoint.save(state)
+
+        elapsed = time.monotonic() - started
+        print(f"  {state['rows'] + pending_rows} rows exported "
+              f"({exported / elapsed if elapsed else 0:.0f} rows/s)")
+
+    sink.close(state)
+    state['rows'] += pending_rows
+    checkpoint.clear()
+
+    elapsed = time.monotonic() - started
+    rate = exported / elapsed if elapsed else 0
+    print(f"Export complete: {state['rows']} rows to {output} in {elapsed:.1f}s ({rate:.0f} rows/s)")
+    return state['rows']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export comprehensive_intake to CSV or Parquet")
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--output', required=True,
+                        help="CSV file, or directory of part files for Parquet")
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--rows-per-part', type=int, default=100000,
+                        help="Rows per Parquet part file")
+    parser.add_argument('--checkpoint', help="Checkpoint file (default: <output>.checkpoint.json)")
+    args = parser.parse_args()
+
+    export_intake(
+        Database(),
+        args.format,
+        args.output,
+        page_size=args.page_size,
+        rows_per_part=args.rows_per_part,
+        checkpoint_path=args.checkpoint
+    )
+
+
+if __name__ == '__main__':
+    main()
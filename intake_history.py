@@ -0,0 +1,290 @@
+"""
+Append-only version log for comprehensive intake submissions.
+
+Every resubmission of the Tally form appends one row to `intake_versions`.
+Most rows only hold the fields that changed since the previous version; every
+`snapshot_interval` versions a full copy of the intake is stored instead, so
+rebuilding any version reads at most `snapshot_interval` rows.
+
+Expected Supabase table:
+
+    create table intake_versions (
+        id uuid primary key,
+        user_id uuid not null,
+        version integer not null,
+        is_snapshot boolean not null default false,
+        data jsonb not null,
+        created_at timestamptz not null,
+        unique (user_id, version)
+    );
+"""
+
+import uuid
+from datetime import datetime
+
+SNAPSHOT_INTERVAL = 10
+
+# Attempts at claiming the next version number when concurrent writers race
+RECORD_ATTEMPTS = 3
+
+# Rows per request when reading many users' versions at once
+PAGE_SIZE = 1000
+
+# Columns that describe the row rather than the user's answers
+UNTRACKED_FIELDS = {'id', 'user_id', 'version', 'created_at', 'updated_at', 'tally_submission_id'}
+
+
+def tracked_fields(intake_data):
+    """Return only the answer fields of an intake row"""
+    return {k: v for k, v in intake_data.items() if k not in UNTRACKED_FIELDS}
+
+
+def compute_diff(old, new):
+    """Fields whose value differs between two intake versions (new values only)"""
+    diff = {}
+    for key in set(old) | set(new):
+        if old.get(key) != new.get(key):
+            diff[key] = new.get(key)
+    return diff
+
+
+def apply_diff(base, diff):
+    """Apply a diff produced by compute_diff to a copy of base"""
+    result = dict(base)
+    result.update(diff)
+    return result
+
+
+def is_version_conflict(error):
+    """Whether an insert failed on unique (user_id, version)"""
+    # Postgres unique_violation, as reported by PostgREST
+    return getattr(error, 'code', None) == '23505' or 'duplicate key' in str(error)
+
+
+def snapshot_version_for(version, interval=SNAPSHOT_INTERVAL):
+    """Version number of the snapshot that version is rebuilt from"""
+    return ((version - 1) // interval) * interval + 1
+
+
+class IntakeHistory:
+    def __init__(self, supabase, guard=None, snapshot_interval=SNAPSHOT_INTERVAL):
+        self.supabase = supabase
+        # resilience.SupabaseGuard giving every query a deadline and breaker
+        self.guard = guard
+        self.snapshot_interval = snapshot_interval
+
+    def _table(self):
+        return self.supabase.table('intake_versions')
+
+    def _execute(self, query, write=False):
+        if self.guard is None:
+            return query.execute()
+        return self.guard.call('intake_versions', query.execute, idempotent=not write)
+
+    def _rebuild(self, rows):
+        """Fold rows (ascending by version, starting at a snapshot) into a full version"""
+        fields = {}
+        for row in rows:
+            if row['is_snapshot']:
+                fields = dict(row['data'])
+            else:
+                fields = apply_diff(fields, row['data'])
+        last = rows[-1]
+        return self._as_version(fields, last)
+
+    @staticmethod
+    def _as_version(fields, row):
+        version = dict(fields)
+        version['version'] = row['version']
+        version['created_at'] = row['created_at']
+        version['updated_at'] = row['created_at']
+        return version
+
+    def record_version(self, user_id, intake_data, created_at=None):
+        """Append intake_data as the user's next version.
+
+        created_at defaults to now; replays pass the original submission time.
+
+        Returns the version number, which is the current one if nothing changed.
+        If another writer claims the same version first (e.g. a retried
+        webhook), the latest version is read again and the insert retried.
+        """
+        fields = tracked_fields(intake_data)
+        for attempt in range(RECORD_ATTEMPTS):
+            try:
+                latest = self.get_latest(user_id, raise_errors=True)
+                if latest:
+                    diff = compute_diff(tracked_fields(latest), fields)
+                    if not diff:
+                        return latest['version']
+                    version = latest['version'] + 1
+                else:
+                    version = 1
+
+                is_snapshot = snapshot_version_for(version, self.snapshot_interval) == version
+                row = {
+                    'id': str(uuid.uuid4()),
+                    'user_id': user_id,
+                    'version': version,
+                    'is_snapshot': is_snapshot,
+                    'data': fields if is_snapshot else diff,
+                    'created_at': created_at or datetime.utcnow().isoformat()
+                }
+                self._execute(self._table().insert(row), write=True)
+                return version
+            except Exception as e:
+                if is_version_conflict(e) and attempt < RECORD_ATTEMPTS - 1:
+                    print(f"Intake version {version} for {user_id} was taken, retrying")
+                    continue
+                print(f"Error recording intake version: {e}")
+                return None
+
+    def record_versions(self, entries):
+        """Append the next version for many users with one read and one bulk insert.
+
+        entries are (user_id, intake_data, created_at), one per user. The
+        intake_data may be a projection; columns it lacks keep their value
+        from the user's latest version. Returns {user_id: version}.
+        """
+        for attempt in range(RECORD_ATTEMPTS):
+            try:
+                latest = self.latest_versions([user_id for user_id, _, _ in entries])
+                rows, versions = [], {}
+                for user_id, intake_data, created_at in entries:
+                    current = latest.get(user_id)
+                    base = tracked_fields(current) if current else {}
+                    fields = apply_diff(base, tracked_fields(intake_data))
+                    diff = compute_diff(base, fields)
+                    if current and not diff:
+                        versions[user_id] = current['version']
+                        continue
+                    version = current['version'] + 1 if current else 1
+                    is_snapshot = snapshot_version_for(version, self.snapshot_interval) == version
+                    rows.append({
+                        'id': str(uuid.uuid4()),
+                        'user_id': user_id,
+                        'version': version,
+                        'is_snapshot': is_snapshot,
+                        'data': fields if is_snapshot else diff,
+                        'created_at': created_at or datetime.utcnow().isoformat()
+                    })
+                    versions[user_id] = version
+                if rows:
+                    self._execute(self._table().insert(rows), write=True)
+                return versions
+            except Exception as e:
+                if is_version_conflict(e) and attempt < RECORD_ATTEMPTS - 1:
+                    print("Intake versions were taken by a concurrent writer, retrying")
+                    continue
+                print(f"Error recording intake versions: {e}")
+                return {}
+
+    def latest_versions(self, user_ids):
+        """{user_id: latest version} for many users, reading their version rows in pages"""
+        rows, last_id = [], None
+        while True:
+            query = self._table().select('*').in_('user_id', list(user_ids)).order('id').limit(PAGE_SIZE)
+            if last_id is not None:
+                query = query.gt('id', last_id)
+            page = self._execute(query).data
+            rows.extend(page)
+            if len(page) < PAGE_SIZE:
+                break
+            last_id = page[-1]['id']
+
+        rows_by_user = {}
+        for row in sorted(rows, key=lambda row: row['version']):
+            rows_by_user.setdefault(row['user_id'], []).append(row)
+        latest = {}
+        for user_id, user_rows in rows_by_user.items():
+            start = max(i for i, row in enumerate(user_rows) if row['is_snapshot'])
+            latest[user_id] = self._rebuild(user_rows[start:])
+        return latest
+
+    def latest_version(self, user_id):
+        """Latest version number for a user, or None without any versions"""
+        try:
+            result = self._execute(
+                self._table().select('version')
+                .eq('user_id', user_id)
+                .order('version', desc=True)
+                .limit(1)
+            )
+            return result.data[0]['version'] if result.data else None
+        except Exception as e:
+            print(f"Error getting latest intake version number: {e}")
+            return None
+
+    def get_latest(self, user_id, raise_errors=False):
+        """Latest intake version, read from at most one snapshot interval of rows"""
+        try:
+            result = self._execute(
+                self._table().select('*')
+                .eq('user_id', user_id)
+                .order('version', desc=True)
+                .limit(self.snapshot_interval)
+            )
+            rows = result.data
+            if not rows:
+                return None
+            rows.reverse()
+            start = max(i for i, row in enumerate(rows) if row['is_snapshot'])
+            return self._rebuild(rows[start:])
+        except Exception as e:
+            if raise_errors:
+                raise
+            print(f"Error getting latest intake version: {e}")
+            return None
+
+    def get_version(self, user_id, version):
+        """Rebuild a specific historical version"""
+        try:
+            base = snapshot_version_for(version, self.snapshot_interval)
+            result = self._execute(
+                self._table().select('*')
+                .eq('user_id', user_id)
+                .gte('version', base)
+                .lte('version', version)
+                .order('version')
+            )
+            rows = result.data
+            if not rows or rows[-1]['version'] != version:
+                return None
+            return self._rebuild(rows)
+        except Exception as e:
+            print(f"Error getting intake version {version}: {e}")
+            return None
+
+    def list_versions(self, user_id):
+        """All versions for a user, newest first"""
+        try:
+            result = self._execute(
+                self._table().select('*')
+                .eq('user_id', user_id)
+                .order('version')
+            )
+            versions = []
+            fields = {}
+            for row in result.data:
+                if row['is_snapshot']:
+                    fields = dict(row['data'])
+                else:
+                    fields = apply_diff(fields, row['data'])
+                versions.append(self._as_version(fields, row))
+            versions.reverse()
+            return versions
+        except Exception as e:
+            print(f"Error listing intake versions: {e}")
+            return []
+
+    def diff_versions(self, user_id, from_version, to_version):
+        """Field-level changes between two versions: {field: {'from': old, 'to': new}}"""
+        old = self.get_version(user_id, from_version)
+        new = self.get_version(user_id, to_version)
+        if old is None or new is None:
+            return None
+        old, new = tracked_fields(old), tracked_fields(new)
+        return {
+            key: {'from': old.get(key), 'to': value}
+            for key, value in compute_diff(old, new).items()
+        }
@@ -80,7 +80,11 @@ class Database:
 """    
 
 from supabase import create_client, Client
+from supabase.lib.client_options import ClientOptions
 from config import Config
+from records import Profile, IntakeRecord, RECORD_TYPES, column_list, parse_timestamp, projection
+from replica import LocalReplica
+from resilience import SupabaseGuard, UpstreamUnavailable
 import uuid
 from datetime import datetime, timedelta, timezone
 
@@ -88,8 +92,78 @@ class Database:
     def __init__(self):
         self.supabase: Client = create_client(
             Config.SUPABASE_URL,
-            Config.SUPABASE_SERVICE_KEY  # Make sure you're using service key, not anon key
+            Config.SUPABASE_SERVICE_KEY,  # Make sure you're using service key, not anon key
+            options=ClientOptions(postgrest_client_timeout=Config.SUPABASE_CLIENT_TIMEOUT)
         )
+        # Bulk scans may take longer per page, so they get a client of their own
+        self.scan_supabase: Client = create_client(
+            Config.SUPABASE_URL,
+            Config.SUPABASE_SERVICE_KEY,
+            options=ClientOptions(postgrest_client_timeout=Config.SUPABASE_SCAN_TIMEOUT)
+        )
+        # Optional local copy of profiles/intake, kept in sync by the write methods below
+        self.replica = LocalReplica(Config.REPLICA_PATH, Config.REPLICA_MAX_STALENESS) if Config.REPLICA_PATH else None
+        # Deadlines, retries and per-table circuit breakers for every Supabase call
+        self.guard = SupabaseGuard(
+            read_timeout=Config.SUPABASE_READ_TIMEOUT,
+            write_timeout=Config.SUPABASE_WRITE_TIMEOUT,
+            read_retries=Config.SUPABASE_READ_RETRIES,
+            hedge_delay=Config.SUPABASE_HEDGE_DELAY,
+            failure_threshold=Config.BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=Config.BREAKER_RESET_SECONDS,
+            max_workers=Config.SUPABASE_GUARD_WORKERS
+        )
+
+    def _read(self, table, query, fallback_key=None, replicate=False):
+        """Execute an idempotent query: deadline, jittered retries, hedging, last-known-good.
+
+        With replicate=True, rows fetched fresh from upstream (never fallback
+        data) are copied into the replica.
+        """
+        def execute():
+            result = query.execute()
+            if replicate:
+                self._replicate(table, result.data)
+            return result
+
+        return self.guard.call(table, execute, idempotent=True, fallback_key=fallback_key)
+
+    def _scan(self, table, query):
+        """Execute one page of a bulk read.
+
+        Bulk reads get their own deadline and are never hedged, and they
+        trip a separate '<table>:scan' breaker so a slow full-table scan
+        cannot cut off per-user lookups.
+        """
+        return self.guard.call(f"{table}:scan", query.execute, idempotent=True,
+                               timeout=Config.SUPABASE_SCAN_TIMEOUT, hedge=False)
+
+    def _write(self, table, query):
+        """Execute a write under its deadline and the table's breaker (never retried)"""
+        return self.guard.call(table, query.execute)
+
+    def _replicate(self, table, rows):
+        """Copy rows just written upstream into the local replica"""
+        if self.replica is None or not rows:
+            return
+        try:
+            self.replica.upsert(table, rows)
+        except Exception as e:
+            # The staleness bound and reconciliation cover a missed copy
+            print(f"Error updating replica for {table}: {e}")
+
+    def _from_replica(self, table, value, columns=None, max_staleness=None):
+        """Record from the replica if it holds a fresh enough copy, else None"""
+        if self.replica is None:
+            return None
+        try:
+            row = self.replica.get(table, value, max_staleness)
+        except Exception as e:
+            print(f"Error reading replica for {table}: {e}")
+            return None
+        if row is None:
+            return None
+        return RECORD_TYPES[table].from_row(row, column_list(columns))
     
     def create_user_profile(self, user_id, email, full_name=None):
         """Create a user profile after signup"""
@@ -119,7 +193,7 @@ class Database:
             print(f"\nData to insert: {data}")
             
             # First, check if profile already exists (shouldn't happen but let's be safe)
-            existing = self.supabase.table('profiles').select("*").eq('id', user_id).execute()
+            existing = self._read('profiles', self._select('profiles', ['id']).eq('id', user_id))
             
             if existing.data:
                 print(f"WARNING: Profile already exists for user {user_id}")
@@ -128,15 +202,17 @@ class Database:
                     'full_name': full_name,
                     'email': email
                 }
-                result = self.supabase.table('profiles').update(update_data).eq('id', user_id).execute()
+                result = self._write('profiles', self.supabase.table('profiles').update(update_data).eq('id', user_id))
                 print(f"Updated existing profile: {result.data}")
             else:
                 # Insert new profile
-                result = self.supabase.table('profiles').insert(data).execute()
+                result = self._write('profiles', self.supabase.table('profiles').insert(data))
                 print(f"Insert result successful: {result.data}")
+
+            self._replicate('profiles', result.data)
             
             # Verify the insertion/update
-            verification = self.supabase.table('profiles').select("*").eq('id', user_id).execute()
+            verification = self._read('profiles', self._select('profiles').eq('id', user_id))
             if verification.data:
                 print(f"\nVERIFICATION - Profile after save:")
                 for key, value in verification.data[0].items():
@@ -153,15 +229,34 @@ class Database:
             print(f"  - Traceback: {traceback.format_exc()}")
             return None
     
-    def get_user_profile(self, user_id):
-        """Get user profile by ID"""
+    def _select(self, table, columns=None, client=None):
+        """Start a select on table, projected to columns (default: all)"""
+        return (client or self.supabase).table(table).select(projection(table, columns))
+
+    def get_user_profile(self, user_id, columns=None):
+        """Get user profile by ID, optionally loading only some columns"""
+        cached = self._from_replica('profiles', user_id, columns)
+        if cached is not None:
+            return cached
         try:
-            result = self.supabase.table('profiles').select("*").eq('id', user_id).execute()
+            result = self._read(
+                'profiles',
+                self._select('profiles', columns).eq('id', user_id),
+                fallback_key=('profiles', user_id, projection('profiles', columns)),
+                replicate=column_list(columns) is None
+            )
             if result.data:
                 print(f"Retrieved profile for {user_id}: {result.data[0]}")
             else:
                 print(f"No profile found for user_id: {user_id}")
-            return result.data[0] if result.data else None
+            return Profile.from_row(result.data[0]) if result.data else None
+        except UpstreamUnavailable:
+            # Any replica copy beats failing, however old
+            stale = self._from_replica('profiles', user_id, columns, max_staleness=float('inf'))
+            if stale is not None:
+                print(f"Supabase unavailable, serving replica profile for {user_id}")
+                return stale
+            raise
         except Exception as e:
             print(f"Error getting profile: {e}")
             return None
@@ -170,22 +265,132 @@ class Database:
         """Update user profile"""
         try:
             print(f"Updating profile {user_id} with: {updates}")
-            result = self.supabase.table('profiles').update(updates).eq('id', user_id).execute()
+            result = self._write('profiles', self.supabase.table('profiles').update(updates).eq('id', user_id))
             print(f"Update result: {result.data}")
+            self._replicate('profiles', result.data)
             return result.data
         except Exception as e:
             print(f"Error updating profile: {e}")
             return None
     
-    def get_user_intake_data(self, user_id):
-        """Get comprehensive intake data for a user"""
+    def get_user_intake_data(self, user_id, columns=None):
+        """Get comprehensive intake data for a user, optionally loading only some columns"""
+        cached = self._from_replica('comprehensive_intake', user_id, columns)
+        if cached is not None:
+            return cached
         try:
-            result = self.supabase.table('comprehensive_intake').select("*").eq('user_id', user_id).execute()
-            return result.data[0] if result.data else None
+            result = self._read(
+                'comprehensive_intake',
+                self._select('comprehensive_intake', columns).eq('user_id', user_id),
+                fallback_key=('comprehensive_intake', user_id, projection('comprehensive_intake', columns)),
+                replicate=column_list(columns) is None
+            )
+            return IntakeRecord.from_row(result.data[0]) if result.data else None
+        except UpstreamUnavailable:
+            stale = self._from_replica('comprehensive_intake', user_id, columns, max_staleness=float('inf'))
+            if stale is not None:
+                print(f"Supabase unavailable, serving replica intake for {user_id}")
+                return stale
+            raise
         except Exception as e:
             print(f"Error getting intake data: {e}")
             return None
-    
+
+    def iter_table_pages(self, table, columns=None, page_size=1000, after=None, key='id', as_records=True):
+        """Yield pages of rows ordered by key, using keyset pagination.
+
+        Each page is fetched with `key > last key seen`, so the cost of a page
+        does not grow with how far into the table we are. Rows of registered
+        tables come back as records unless as_records is False.
+        """
+        if columns and columns != '*':
+            columns = [c.strip() for c in columns.split(',')] if isinstance(columns, str) else list(columns)
+            if key not in columns:
+                columns.append(key)
+        record_type = RECORD_TYPES.get(table) if as_records else None
+
+        last = after
+        while True:
+            query = self._select(table, columns, self.scan_supabase).order(key).limit(page_size)
+            if last is not None:
+                query = query.gt(key, last)
+            rows = self._scan(table, query).data
+            if not rows:
+                return
+            last = rows[-1][key]
+            yield record_type.from_rows(rows) if record_type else rows
+            if len(rows) < page_size:
+                return
+
+    def save_intake_data(self, user_id, intake_data):
+        """Insert or update the user's comprehensive_intake row from an IntakeRecord"""
+        # Ask upstream, not the replica: a stale local copy would turn this
+        # into an update that matches no rows
+        existing = self._read(
+            'comprehensive_intake',
+            self._select('comprehensive_intake', ['id']).eq('user_id', user_id)
+        ).data
+
+        result = None
+        if existing:
+            print(f"\n✓ Updating existing intake data for user {user_id}")
+            result = self._write('comprehensive_intake', self.supabase.table('comprehensive_intake').update(intake_data.to_payload()).eq('user_id', user_id))
+            if not result.data:
+                # Deleted since we looked
+                print(f"Intake row for user {user_id} is gone, inserting instead")
+                result = None
+        if result is None:
+            print(f"\n✓ Creating new intake data for user {user_id}")
+            intake_data['id'] = str(uuid.uuid4())
+            intake_data['created_at'] = datetime.utcnow().isoformat()
+            result = self._write('comprehensive_intake', self.supabase.table('comprehensive_intake').insert(intake_data.to_payload()))
+
+        self._replicate('comprehensive_intake', result.data)
+        return result
+
+    def bulk_upsert_intake(self, records):
+        """Insert or update many users' intake rows in two round trips.
+
+        Existing rows keep their id and created_at; the upsert then matches
+        on id, so no unique constraint on user_id is needed. Records older
+        (by updated_at) than the stored row are skipped, so replaying an old
+        export never overwrites a newer submission. Every record must carry
+        the same columns, since a bulk upsert nulls missing ones.
+
+        Returns the rows written.
+        """
+        if not records:
+            return []
+        user_ids = [record.user_id for record in records]
+        existing = self._scan(
+            'comprehensive_intake',
+            self._select('comprehensive_intake', ['id', 'user_id', 'created_at', 'updated_at'], self.scan_supabase)
+            .in_('user_id', user_ids)
+        ).data
+        existing_by_user = {row['user_id']: row for row in existing}
+
+        now = datetime.utcnow().isoformat()
+        payload = []
+        for record in records:
+            row = existing_by_user.get(record.user_id)
+            if row:
+                stored_at = parse_timestamp(row.get('updated_at'))
+                submitted_at = parse_timestamp(record.get('updated_at'))
+                if stored_at and submitted_at and stored_at > submitted_at:
+                    continue
+            record['id'] = row['id'] if row else str(uuid.uuid4())
+            record['created_at'] = row['created_at'] if row else now
+            payload.append(record.to_payload())
+        if not payload:
+            return []
+
+        result = self._write(
+            'comprehensive_intake',
+            self.supabase.table('comprehensive_intake').upsert(payload, on_conflict='id')
+        )
+        self._replicate('comprehensive_intake', result.data)
+        return result.data
+
     def save_tally_submission(self, user_id, tally_data):
         """Save Tally form submission ID"""
         try:
@@ -196,14 +401,15 @@ class Database:
             }
             
             # Check if intake exists
-            existing = self.get_user_intake_data(user_id)
+            existing = self.get_user_intake_data(user_id, columns=['id'])
             if existing:
-                result = self.supabase.table('comprehensive_intake').update(data).eq('user_id', user_id).execute()
+                result = self._write('comprehensive_intake', self.supabase.table('comprehensive_intake').update(data).eq('user_id', user_id))
             else:
                 data['id'] = str(uuid.uuid4())
                 data['created_at'] = datetime.utcnow().isoformat()
-                result = self.supabase.table('comprehensive_intake').insert(data).execute()
+                result = self._write('comprehensive_intake', self.supabase.table('comprehensive_intake').insert(data))
             
+            self._replicate('comprehensive_intake', result.data)
             return result.data
         except Exception as e:
             print(f"Error saving Tally submission: {e}")
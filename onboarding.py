@@ -0,0 +1,113 @@
+"""
+Signed onboarding-state claims kept in the user's session.
+
+Routing between /tally-form and /home only needs to know whether the user
+has a profile and a completed intake. Those facts are issued as a signed,
+expiring token at login and reused on every navigation; they are only looked
+up in Supabase again once the claims expire or are missing.
+
+Tally's webhook reaches us without the user's session, so it records the
+completed submission here instead, and the user's claims are upgraded from
+that record the next time they are read. Records are dropped once folded
+into claims, or after max_age.
+"""
+
+import threading
+import time
+
+from flask import session
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+SESSION_KEY = 'onboarding'
+
+
+class Onboarding:
+    def __init__(self, db, secret_key, max_age=900, history=None):
+        self.db = db
+        self.max_age = max_age
+        # IntakeHistory, the source of the intake version claim
+        self.history = history
+        self.serializer = URLSafeTimedSerializer(secret_key, salt='onboarding-claims')
+        # user_id -> completed submission seen by the webhook in this process
+        self.submissions = {}
+        self._lock = threading.Lock()
+
+    def issue(self, user_id, profile_exists, intake_completed, intake_version=None):
+        """Sign the claims and store them in the session"""
+        claims = {
+            'user_id': user_id,
+            'profile_exists': bool(profile_exists),
+            'intake_completed': bool(intake_completed),
+            'intake_version': intake_version
+        }
+        session[SESSION_KEY] = self.serializer.dumps(claims)
+        return claims
+
+    def read(self, user_id):
+        """Valid, unexpired claims for user_id from the session, or None"""
+        token = session.get(SESSION_KEY)
+        if not token:
+            return None
+        try:
+            claims = self.serializer.loads(token, max_age=self.max_age)
+        except BadSignature:
+            # Also covers SignatureExpired
+            return None
+        if claims.get('user_id') != user_id:
+            return None
+        return claims
+
+    def record_submission(self, user_id, intake_version=None):
+        """Called by the webhook once an intake has been saved"""
+        now = time.time()
+        with self._lock:
+            # Claims would have been revalidated against Supabase by now
+            for stale in [uid for uid, s in self.submissions.items() if now - s['recorded_at'] > self.max_age]:
+                del self.submissions[stale]
+            self.submissions[user_id] = {
+                'completed': True,
+                'intake_version': intake_version,
+                'recorded_at': now
+            }
+
+    def _take_submission(self, user_id):
+        """Remove and return this process's webhook record for user_id, if any"""
+        with self._lock:
+            return self.submissions.pop(user_id, None)
+
+    def intake_version(self, user_id):
+        """Latest intake version number from the version log"""
+        if self.history is None:
+            return None
+        return self.history.latest_version(user_id)
+
+    def revalidate(self, user_id):
+        """Look the user's onboarding state up in Supabase and reissue the claims"""
+        profile = self.db.get_user_profile(user_id, columns=['id'])
+        intake = self.db.get_user_intake_data(user_id, columns=['id'])
+        submission = self._take_submission(user_id) or {}
+        intake_version = None
+        if intake is not None:
+            intake_version = self.intake_version(user_id) or submission.get('intake_version')
+        return self.issue(user_id, profile is not None, intake is not None, intake_version)
+
+    def state(self, user_id, recheck_incomplete=False):
+        """Onboarding claims for user_id, going to Supabase only when needed.
+
+        Claims that say the intake is not completed are upgraded from a
+        webhook record in this process; with recheck_incomplete they are
+        also checked against Supabase, since the webhook may have been
+        handled by another worker.
+        """
+        claims = self.read(user_id)
+        if claims is None:
+            return self.revalidate(user_id)
+
+        if not claims['intake_completed']:
+            submission = self._take_submission(user_id)
+            if submission:
+                return self.issue(user_id, claims['profile_exists'], True,
+                                  submission.get('intake_version'))
+            if recheck_incomplete:
+                return self.revalidate(user_id)
+        return claims
@@ -0,0 +1,201 @@
+"""
+Compact record types for rows of our Supabase tables.
+
+Records keep their values in __slots__ instead of a per-row dict, which is
+what makes holding many intakes in memory affordable for bulk jobs. Each
+record type declares its columns and their Python types; SCHEMA maps table
+names to those declarations and is used to validate column projections.
+
+A record only carries the columns it was loaded with (a projection), and
+to_payload() only sends those back, so a partial record never overwrites
+columns it did not read. Records also support the read side of the dict
+interface (get, [], keys, items) so code written against raw rows keeps working.
+"""
+
+from datetime import datetime, timezone
+
+
+class Record:
+    __slots__ = ('_columns',)
+
+    TABLE = None
+    COLUMNS = {}
+
+    def __init__(self, **values):
+        columns = []
+        for name, value in values.items():
+            self._check_column(name)
+            setattr(self, name, value)
+            columns.append(name)
+        self._columns = tuple(columns)
+
+    @classmethod
+    def _check_column(cls, name):
+        if name not in cls.COLUMNS:
+            raise KeyError(f"{cls.TABLE} has no column {name!r}")
+
+    @classmethod
+    def from_values(cls, columns, values):
+        """Build a record from parallel column/value sequences.
+
+        Pass the same columns tuple for every record of a batch; records share it.
+        """
+        record = cls.__new__(cls)
+        for name, value in zip(columns, values):
+            setattr(record, name, value)
+        record._columns = columns
+        return record
+
+    @classmethod
+    def from_row(cls, row, columns=None):
+        """Build a record from a Supabase row in one pass.
+
+        Keys that are not columns of this table are ignored.
+        """
+        if columns is None:
+            columns = tuple(name for name in row if name in cls.COLUMNS)
+        record = cls.__new__(cls)
+        for name in columns:
+            setattr(record, name, row.get(name))
+        record._columns = columns
+        return record
+
+    @classmethod
+    def from_rows(cls, rows, columns=None):
+        """Convert a page of rows, sharing one columns tuple between them"""
+        if not rows:
+            return []
+        if columns is None:
+            columns = tuple(name for name in rows[0] if name in cls.COLUMNS)
+        return [cls.from_row(row, columns) for row in rows]
+
+    def to_payload(self):
+        """Dict of the loaded columns, ready to send to Supabase"""
+        return {name: getattr(self, name) for name in self._columns}
+
+    # Read-only dict interface, so records can stand in for raw rows
+
+    def keys(self):
+        return self._columns
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in self._columns]
+
+    def get(self, name, default=None):
+        if name in self._columns:
+            return getattr(self, name)
+        return default
+
+    def __getitem__(self, name):
+        if name not in self._columns:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __setitem__(self, name, value):
+        self._check_column(name)
+        setattr(self, name, value)
+        if name not in self._columns:
+            self._columns = self._columns + (name,)
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __eq__(self, other):
+        if not isinstance(other, Record):
+            return NotImplemented
+        return type(self) is type(other) and self.to_payload() == other.to_payload()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_payload()!r})"
+
+
+class Profile(Record):
+    TABLE = 'profiles'
+    COLUMNS = {
+        'id': str,
+        'email': str,
+        'full_name': str,
+        'created_at': str,
+    }
+    __slots__ = tuple(COLUMNS)
+
+
+class IntakeRecord(Record):
+    TABLE = 'comprehensive_intake'
+    # list columns hold the selected option texts, or a single text when only one was selected
+    COLUMNS = {
+        'id': str,
+        'user_id': str,
+        'tally_submission_id': str,
+        'preferred_name': str,
+        'birthday': str,
+        'location': str,
+        'biological_sex': str,
+        'goals': list,
+        'chronic_conditions': str,
+        'medications_supplements': str,
+        'pregnancy_status': str,
+        'has_menstrual_cycle': str,
+        'menstrual_symptoms': list,
+        'bowel_movement_frequency': str,
+        'bowel_movement_type': str,
+        'digestive_symptoms': list,
+        'other_symptoms': list,
+        'body_temperature': str,
+        'nervous_system_signals': list,
+        'energy_pattern': str,
+        'sleep_pattern': str,
+        'movement_level': str,
+        'appetite_pattern': str,
+        'diet_type': str,
+        'food_allergies': str,
+        'emotional_patterns': list,
+        'birth_history': str,
+        'past_medications': list,
+        'significant_history': list,
+        'created_at': str,
+        'updated_at': str,
+    }
+    __slots__ = tuple(COLUMNS)
+
+
+# Table name -> record type
+RECORD_TYPES = {cls.TABLE: cls for cls in (Profile, IntakeRecord)}
+
+# Table name -> {column: Python type}
+SCHEMA = {table: cls.COLUMNS for table, cls in RECORD_TYPES.items()}
+
+
+def column_list(columns=None):
+    """Normalize a projection ('a,b', ['a', 'b'], '*' or None) to a tuple, or None for all columns"""
+    if not columns or columns == '*':
+        return None
+    if isinstance(columns, str):
+        columns = columns.split(',')
+    return tuple(c.strip() for c in columns)
+
+
+def projection(table, columns=None):
+    """Validate a column projection and return it as a Supabase select string"""
+    columns = column_list(columns)
+    if columns is None:
+        return '*'
+    known = SCHEMA.get(table)
+    if known is not None:
+        unknown = [c for c in columns if c not in known]
+        if unknown:
+            raise KeyError(f"{table} has no column(s) {', '.join(unknown)}")
+    return ','.join(columns)
+
+
+def parse_timestamp(value):
+    """Parse an ISO timestamp column as an aware UTC datetime (naive values are UTC), or None"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
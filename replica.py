@@ -0,0 +1,197 @@
+"""
+Local SQLite read replica of the profiles and comprehensive_intake tables.
+
+Our app is the only writer of both tables, so Database copies every row it
+successfully writes upstream into this replica, and serves reads from it as
+long as the local copy is younger than the staleness bound. Anything that
+falls outside the bound (or was never seen) is read from Supabase again.
+
+Enabled by setting REPLICA_PATH. Commands:
+
+    python replica.py hydrate                  # initial bulk copy
+    python replica.py reconcile                # repair drift once
+    python replica.py reconcile --interval 600 # ... every 10 minutes
+"""
+
+import argparse
+import json
+import sqlite3
+import threading
+import time
+
+# Replicated tables -> the column reads look rows up by
+TABLES = {
+    'profiles': 'id',
+    'comprehensive_intake': 'user_id',
+}
+
+
+def _encode(row):
+    return json.dumps(row, sort_keys=True, default=str)
+
+
+class LocalReplica:
+    def __init__(self, path, max_staleness=300):
+        self.path = path
+        self.max_staleness = max_staleness
+        self._local = threading.local()
+        self._create_tables()
+
+    def _connect(self):
+        """One connection per thread; Flask may serve requests on several"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _create_tables(self):
+        conn = self._connect()
+        with conn:
+            for table in TABLES:
+                conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        id TEXT PRIMARY KEY,
+                        user_id TEXT,
+                        data TEXT NOT NULL,
+                        synced_at REAL NOT NULL
+                    )
+                """)
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_user_id ON {table} (user_id)")
+
+    @staticmethod
+    def _check_table(table):
+        if table not in TABLES:
+            raise KeyError(f"{table} is not replicated")
+
+    def _upsert(self, conn, table, rows, synced_at):
+        # Never let an older copy of a row replace a newer one
+        conn.executemany(f"""
+            INSERT INTO {table} (id, user_id, data, synced_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                user_id = excluded.user_id,
+                data = excluded.data,
+                synced_at = excluded.synced_at
+            WHERE excluded.synced_at >= {table}.synced_at
+        """, [
+            (row['id'], row.get('user_id', row['id']), _encode(row), synced_at)
+            for row in rows
+        ])
+
+    def upsert(self, table, rows, synced_at=None):
+        """Store full upstream rows in one transaction"""
+        self._check_table(table)
+        rows = [row.to_payload() if hasattr(row, 'to_payload') else row for row in rows or []]
+        if not rows:
+            return 0
+        conn = self._connect()
+        with conn:
+            self._upsert(conn, table, rows, synced_at or time.time())
+        return len(rows)
+
+    def get(self, table, value, max_staleness=None):
+        """Row whose lookup column equals value, or None if missing or too old"""
+        self._check_table(table)
+        max_staleness = self.max_staleness if max_staleness is None else max_staleness
+        row = self._connect().execute(
+            f"SELECT data, synced_at FROM {table} WHERE {TABLES[table]} = ? "
+            f"ORDER BY synced_at DESC LIMIT 1",
+            (value,)
+        ).fetchone()
+        if row is None:
+            return None
+        data, synced_at = row
+        if max_staleness is not None and time.time() - synced_at > max_staleness:
+            return None
+        return json.loads(data)
+
+    def count(self, table):
+        self._check_table(table)
+        return self._connect().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def hydrate(self, db, page_size=1000):
+        """Copy both tables from Supabase into the replica"""
+        totals = {}
+        for table in TABLES:
+            started = time.monotonic()
+            totals[table] = 0
+            for page in db.iter_table_pages(table, page_size=page_size, as_records=False):
+                totals[table] += self.upsert(table, page)
+            elapsed = time.monotonic() - started
+            print(f"Hydrated {totals[table]} {table} rows in {elapsed:.1f}s")
+        return totals
+
+    def reconcile(self, db, page_size=1000):
+        """Compare the replica with Supabase and repair any drift.
+
+        Rows that differ are rewritten, rows that match are marked fresh,
+        and rows that no longer exist upstream are removed.
+        """
+        stats = {}
+        conn = self._connect()
+        for table in TABLES:
+            started = time.time()
+            checked = repaired = 0
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS seen (id TEXT PRIMARY KEY)")
+            conn.execute("DELETE FROM seen")
+
+            for page in db.iter_table_pages(table, page_size=page_size, as_records=False):
+                fetched_at = time.time()
+                ids = [row['id'] for row in page]
+                placeholders = ','.join('?' * len(ids))
+                local = dict(conn.execute(
+                    f"SELECT id, data FROM {table} WHERE id IN ({placeholders})", ids
+                ).fetchall())
+                changed = [row for row in page if local.get(row['id']) != _encode(row)]
+
+                with conn:
+                    conn.executemany("INSERT OR IGNORE INTO seen (id) VALUES (?)", [(i,) for i in ids])
+                    self._upsert(conn, table, changed, fetched_at)
+                    conn.execute(
+                        f"UPDATE {table} SET synced_at = ? WHERE id IN ({placeholders}) AND synced_at < ?",
+                        [fetched_at, *ids, fetched_at]
+                    )
+                checked += len(page)
+                repaired += len(changed)
+
+            # Rows written after the scan started may not have been seen yet
+            with conn:
+                deleted = conn.execute(
+                    f"DELETE FROM {table} WHERE id NOT IN (SELECT id FROM seen) AND synced_at < ?",
+                    (started,)
+                ).rowcount
+            stats[table] = {'checked': checked, 'repaired': repaired, 'deleted': deleted}
+            print(f"Reconciled {table}: {checked} checked, {repaired} repaired, {deleted} deleted")
+        return stats
+
+
+def main():
+    from config import Config
+    from models import Database
+
+    parser = argparse.ArgumentParser(description="Manage the local SQLite replica")
+    parser.add_argument('command', choices=['hydrate', 'reconcile'])
+    parser.add_argument('--interval', type=int,
+                        help="Repeat reconcile every N seconds instead of running once")
+    parser.add_argument('--page-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    if not Config.REPLICA_PATH:
+        raise SystemExit("REPLICA_PATH is not set")
+
+    db = Database()
+    if args.command == 'hydrate':
+        db.replica.hydrate(db, page_size=args.page_size)
+        return
+
+    while True:
+        db.replica.reconcile(db, page_size=args.page_size)
+        if not args.interval:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
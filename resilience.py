@@ -0,0 +1,275 @@
+"""
+Deadlines, retries, hedging and circuit breaking for Supabase calls.
+
+supabase-py calls are blocking and have no per-call deadline, so each call
+runs on a small thread pool and we stop waiting for it once its deadline
+passes (the abandoned call finishes in the background, bounded by the
+client's own HTTP timeout). Time spent queued for a pool thread is reported
+separately from time spent waiting on Supabase. On top of that:
+
+- idempotent reads are retried with full-jitter exponential backoff, and
+  can be hedged: if the first attempt has not answered after hedge_delay,
+  a second one is started and whichever finishes first wins;
+- every table has a circuit breaker that opens after a run of failures
+  and lets a single trial call through once reset_timeout has passed;
+- successful reads are remembered as last-known-good, and served when
+  upstream is failing or the breaker is open.
+
+Only transient errors (timeouts, transport errors, 5xx/429 and Postgres
+connection/resource errors) are retried and count against the breaker.
+Anything else, such as a bad column, a duplicate key or an RLS denial, means
+upstream answered; it is re-raised unchanged on the first attempt.
+
+When none of that yields an answer, UpstreamUnavailable is raised so callers
+can tell "Supabase is down" apart from "the row does not exist".
+"""
+
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+
+# PostgREST's own connection/schema-cache errors
+TRANSIENT_POSTGREST_CODES = {'PGRST000', 'PGRST001', 'PGRST002', 'PGRST003'}
+# SQLSTATE classes: connection exception, transaction rollback (deadlock,
+# serialization), insufficient resources, operator intervention (statement timeout)
+TRANSIENT_SQLSTATE_CLASSES = ('08', '40', '53', '57')
+
+
+class UpstreamUnavailable(Exception):
+    """Supabase could not answer in time and no fallback data was available"""
+
+
+def is_transient(error):
+    """Whether error may go away on retry, as opposed to a bad request"""
+    if isinstance(error, (TimeoutError, ConnectionError, httpx.TransportError)):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status >= 500 or status == 429
+    # postgrest's APIError carries a PostgREST code, a SQLSTATE, or the HTTP
+    # status when the response body was not JSON (e.g. a gateway error page)
+    code = str(getattr(error, 'code', None) or '')
+    if len(code) == 3 and code.isdigit():
+        return int(code) >= 500 or int(code) == 429
+    return code in TRANSIENT_POSTGREST_CODES or code[:2] in TRANSIENT_SQLSTATE_CLASSES
+
+
+class TransientFailure(Exception):
+    """Every attempt of a call failed transiently; the last error is the cause"""
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go upstream now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                # Exactly one trial call decides whether to close again
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def snapshot(self):
+        with self._lock:
+            return {'state': self.state, 'consecutive_failures': self.failures}
+
+
+class SupabaseGuard:
+    # Counters kept per table
+    COUNTERS = ('calls', 'failures', 'timeouts', 'retries', 'hedges', 'fallbacks', 'rejected')
+    # Seconds spent waiting for a pool thread vs. waiting on Supabase, per table
+    TIMERS = ('queued_seconds', 'upstream_seconds')
+
+    def __init__(self, read_timeout=2.0, write_timeout=5.0, read_retries=2,
+                 backoff_base=0.1, hedge_delay=0.3, failure_threshold=5,
+                 reset_timeout=30, max_workers=16, cache_size=1024):
+        self.read_timeout = read_timeout
+        self.write_timeout = write_timeout
+        self.read_retries = read_retries
+        self.backoff_base = backoff_base
+        self.hedge_delay = hedge_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.cache_size = cache_size
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='supabase')
+        self._breakers = {}
+        self._metrics = {}
+        self._last_known_good = OrderedDict()
+        self._lock = threading.Lock()
+
+    def breaker(self, table):
+        with self._lock:
+            if table not in self._breakers:
+                self._breakers[table] = CircuitBreaker(table, self.failure_threshold, self.reset_timeout)
+                self._metrics[table] = dict.fromkeys(self.COUNTERS, 0)
+                self._metrics[table].update(dict.fromkeys(self.TIMERS, 0.0))
+            return self._breakers[table]
+
+    def _count(self, table, counter, amount=1):
+        with self._lock:
+            self._metrics[table][counter] += amount
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._last_known_good[key] = value
+            self._last_known_good.move_to_end(key)
+            while len(self._last_known_good) > self.cache_size:
+                self._last_known_good.popitem(last=False)
+
+    def _recall(self, key):
+        with self._lock:
+            if key in self._last_known_good:
+                return True, self._last_known_good[key]
+            return False, None
+
+    def _attempt(self, table, fn, timeout, hedge):
+        """Run fn once (or twice, hedged) and return the first successful result"""
+        deadline = time.monotonic() + timeout
+
+        def submit():
+            submitted = time.monotonic()
+
+            def timed():
+                started = time.monotonic()
+                self._count(table, 'queued_seconds', started - submitted)
+                try:
+                    return fn()
+                finally:
+                    self._count(table, 'upstream_seconds', time.monotonic() - started)
+
+            return self._pool.submit(timed)
+
+        futures = [submit()]
+        if hedge and self.hedge_delay and self.hedge_delay < timeout:
+            done, _ = wait(futures, timeout=self.hedge_delay)
+            if not done:
+                self._count(table, 'hedges')
+                futures.append(submit())
+
+        error = None
+        pending = set(futures)
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        if error is not None and not pending:
+            raise error
+        self._count(table, 'timeouts')
+        raise TimeoutError(f"{table} call exceeded {timeout:.1f}s")
+
+    def _call(self, table, fn, attempts, timeout, hedge, fallback_key):
+        """Attempts of one logical call; raises TransientFailure once they are used up"""
+        breaker = self.breaker(table)
+        for attempt in range(attempts):
+            if attempt:
+                self._count(table, 'retries')
+                time.sleep(random.uniform(0, self.backoff_base * 2 ** attempt))
+
+            self._count(table, 'calls')
+            try:
+                result = self._attempt(table, fn, timeout, hedge)
+            except Exception as e:
+                if not is_transient(e):
+                    # Upstream answered, the request itself was rejected
+                    breaker.record_success()
+                    raise
+                print(f"Supabase {table} call failed (attempt {attempt + 1}/{attempts}): {e}")
+                if attempt == attempts - 1:
+                    raise TransientFailure() from e
+                continue
+
+            breaker.record_success()
+            if fallback_key is not None:
+                self._remember(fallback_key, result)
+            return result
+
+    def call(self, table, fn, idempotent=False, timeout=None, fallback_key=None, hedge=None):
+        """Call fn() under the table's deadline, retry policy and breaker.
+
+        Reads should pass idempotent=True; only those are retried, and they
+        are also hedged unless hedge=False. A logical call records at most
+        one breaker failure however many attempts it made. Non-transient
+        errors are re-raised as they are.
+        With a fallback_key, a successful result is remembered and returned
+        again when upstream cannot answer.
+        """
+        breaker = self.breaker(table)
+        timeout = timeout or (self.read_timeout if idempotent else self.write_timeout)
+        attempts = 1 + (self.read_retries if idempotent else 0)
+        hedge = idempotent if hedge is None else hedge
+
+        if breaker.allow():
+            try:
+                return self._call(table, fn, attempts, timeout, hedge, fallback_key)
+            except TransientFailure as e:
+                self._count(table, 'failures')
+                breaker.record_failure()
+                error = e.__cause__
+        else:
+            self._count(table, 'rejected')
+            error = UpstreamUnavailable(f"Circuit breaker for {table} is open")
+
+        if fallback_key is not None:
+            found, value = self._recall(fallback_key)
+            if found:
+                self._count(table, 'fallbacks')
+                print(f"Serving last-known-good data for {table}")
+                return value
+        if isinstance(error, UpstreamUnavailable):
+            raise error
+        raise UpstreamUnavailable(f"Supabase {table} call failed: {error}") from error
+
+    def snapshot(self):
+        """Breaker state and counters per table, for the metrics endpoint"""
+        with self._lock:
+            tables = list(self._breakers)
+        result = {}
+        for table in tables:
+            with self._lock:
+                metrics = dict(self._metrics[table])
+            for timer in self.TIMERS:
+                metrics[timer] = round(metrics[timer], 3)
+            metrics['breaker'] = self._breakers[table].snapshot()
+            result[table] = metrics
+        return result
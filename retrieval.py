@@ -0,0 +1,432 @@
+"""
+Local BM25 retrieval over the wellness knowledge corpus.
+
+The index is a directory of immutable segments plus a manifest. Each segment
+stores its sorted vocabulary, CSR postings (doc ids and term frequencies),
+document lengths and the stored documents as .npy / .jsonl files, all opened
+with mmap, so loading an index only maps files and takes milliseconds.
+
+Queries are scored per segment with vectorized NumPy operations (one
+bincount over the postings of the query terms), using collection statistics
+summed across segments. Adding documents writes a new segment; replaced or
+deleted documents are masked out until `compact` rewrites a single segment.
+Recent query results are kept in a small LRU cache.
+
+    python retrieval.py build knowledge/corpus.jsonl --index knowledge/index
+    python retrieval.py add new_docs.jsonl --index knowledge/index
+    python retrieval.py compact --index knowledge/index
+    python retrieval.py search "bloating poor sleep" --index knowledge/index
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import shutil
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Longer tokens are truncated so the vocabulary fits a fixed-width array
+MAX_TERM_LENGTH = 32
+
+STOPWORDS = frozenset("""
+a an and are as at be by do for from has have how i if in into is it its
+me my no not of on or our so than that the their them then there these
+they this to too up was we what when which while who why will with you your
+""".split())
+
+# Intake columns that describe what the user wants help with
+QUERY_FIELDS = (
+    'goals',
+    'digestive_symptoms',
+    'bowel_movement_type',
+    'bowel_movement_frequency',
+    'other_symptoms',
+    'nervous_system_signals',
+    'emotional_patterns',
+    'energy_pattern',
+    'sleep_pattern',
+    'appetite_pattern',
+    'body_temperature',
+    'movement_level',
+    'menstrual_symptoms',
+    'significant_history',
+    'chronic_conditions',
+)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text):
+    return [
+        token[:MAX_TERM_LENGTH]
+        for token in TOKEN_RE.findall(text.lower())
+        if token not in STOPWORDS
+    ]
+
+
+def document_text(doc):
+    """Text indexed for a document; the title counts twice"""
+    parts = [doc.get('title', ''), doc.get('title', ''), doc.get('category', ''),
+             doc.get('description', ''), doc.get('body', '')]
+    parts.extend(doc.get('tags', []))
+    return ' '.join(p for p in parts if p)
+
+
+def intake_query(intake):
+    """Build a query string from the answers in an intake row"""
+    parts = []
+    for field in QUERY_FIELDS:
+        value = intake.get(field)
+        if isinstance(value, list):
+            parts.extend(str(v) for v in value if v)
+        elif value:
+            parts.append(str(value))
+    return ' '.join(parts)
+
+
+def load_corpus(path):
+    """Stream documents from a JSON lines file"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def write_segment(path, documents):
+    """Write an immutable segment for documents (a list of dicts with an 'id')"""
+    os.makedirs(path)
+    term_ids = {}
+    pair_terms = []
+    pair_docs = []
+    doc_lens = np.zeros(len(documents), dtype=np.float32)
+
+    with open(os.path.join(path, 'docs.jsonl'), 'wb') as f:
+        offsets = [0]
+        for i, doc in enumerate(documents):
+            tokens = tokenize(document_text(doc))
+            doc_lens[i] = len(tokens)
+            for token in tokens:
+                pair_terms.append(term_ids.setdefault(token, len(term_ids)))
+            pair_docs.extend([i] * len(tokens))
+            offsets.append(offsets[-1] + f.write(json.dumps(doc).encode('utf-8') + b'\n'))
+
+    n_docs = len(documents)
+    vocab = np.array(list(term_ids), dtype=f'S{MAX_TERM_LENGTH}')
+    order = np.argsort(vocab, kind='stable')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+
+    # One (term, doc) key per token occurrence; unique() sorts by term then doc
+    # and counts occurrences, which gives the term frequencies
+    keys = rank[np.array(pair_terms, dtype=np.int64)] * max(n_docs, 1) + np.array(pair_docs, dtype=np.int64)
+    keys, tf = np.unique(keys, return_counts=True)
+    post_terms = keys // max(n_docs, 1)
+    df = np.bincount(post_terms, minlength=len(vocab)).astype(np.int32)
+
+    np.save(os.path.join(path, 'terms.npy'), vocab[order])
+    np.save(os.path.join(path, 'df.npy'), df)
+    np.save(os.path.join(path, 'indptr.npy'), np.concatenate(([0], np.cumsum(df, dtype=np.int64))))
+    np.save(os.path.join(path, 'post_docs.npy'), (keys % max(n_docs, 1)).astype(np.int32))
+    np.save(os.path.join(path, 'post_tf.npy'), tf.astype(np.float32))
+    np.save(os.path.join(path, 'doc_len.npy'), doc_lens)
+    np.save(os.path.join(path, 'doc_offsets.npy'), np.array(offsets, dtype=np.int64))
+    np.save(os.path.join(path, 'ids.npy'), np.array([str(doc['id']).encode('utf-8') for doc in documents]))
+
+
+class Segment:
+    """A read-only, memory-mapped segment"""
+
+    def __init__(self, path, deleted=()):
+        self.path = path
+        self.name = os.path.basename(path)
+
+        def load(name):
+            return np.load(os.path.join(path, name), mmap_mode='r')
+
+        self.terms = load('terms.npy')
+        self.df = load('df.npy')
+        self.indptr = load('indptr.npy')
+        self.post_docs = load('post_docs.npy')
+        self.post_tf = load('post_tf.npy')
+        self.doc_len = load('doc_len.npy')
+        self.doc_offsets = load('doc_offsets.npy')
+        self.ids = load('ids.npy')
+        self.size = len(self.doc_len)
+        self.deleted = np.array(sorted(deleted), dtype=np.int64)
+        self.live_count = self.size - len(self.deleted)
+        self.live_length = float(self.doc_len.sum()) - float(self.doc_len[self.deleted].sum())
+        self._docs_file = None
+
+    def lookup(self, term):
+        """Vocabulary position of term (bytes), or -1"""
+        i = int(np.searchsorted(self.terms, term))
+        if i < len(self.terms) and self.terms[i] == term:
+            return i
+        return -1
+
+    def live_df(self, position):
+        """Document frequency of a vocabulary position, not counting deleted documents"""
+        df = int(self.df[position])
+        if len(self.deleted):
+            start, end = self.indptr[position], self.indptr[position + 1]
+            df -= int(np.count_nonzero(np.isin(self.post_docs[start:end], self.deleted)))
+        return df
+
+    def document(self, i):
+        if self._docs_file is None:
+            self._docs_file = np.memmap(os.path.join(self.path, 'docs.jsonl'), dtype=np.uint8, mode='r') \
+                if self.doc_offsets[-1] else b''
+        start, end = int(self.doc_offsets[i]), int(self.doc_offsets[i + 1])
+        return json.loads(bytes(self._docs_file[start:end]))
+
+    def find(self, doc_ids):
+        """Local positions of any of doc_ids in this segment"""
+        if not self.size:
+            return []
+        encoded = np.array([str(doc_id).encode('utf-8') for doc_id in doc_ids])
+        return np.flatnonzero(np.isin(self.ids, encoded)).tolist()
+
+    def score(self, term_weights, avgdl, k):
+        """Top-k (scores, local doc positions) for [(vocab position, idf * query tf)]"""
+        doc_chunks, score_chunks = [], []
+        for position, weight in term_weights:
+            start, end = self.indptr[position], self.indptr[position + 1]
+            docs = np.asarray(self.post_docs[start:end])
+            tf = np.asarray(self.post_tf[start:end])
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * np.asarray(self.doc_len[docs]) / avgdl)
+            doc_chunks.append(docs)
+            score_chunks.append(weight * tf * (BM25_K1 + 1) / (tf + norm))
+        if not doc_chunks:
+            return np.empty(0), np.empty(0, dtype=np.int64)
+
+        scores = np.bincount(np.concatenate(doc_chunks), weights=np.concatenate(score_chunks),
+                             minlength=self.size)
+        if len(self.deleted):
+            scores[self.deleted] = 0
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(scores[candidates], -k)[-k:]]
+        return scores[candidates], candidates
+
+
+class RetrievalIndex:
+    def __init__(self, path, cache_size=256):
+        self.path = path
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._manifest_mtime = None
+        self.segments = []
+        self._load()
+
+    # Manifest and segments
+
+    def _manifest_path(self):
+        return os.path.join(self.path, 'manifest.json')
+
+    def _read_manifest(self):
+        if not os.path.exists(self._manifest_path()):
+            return {'segments': [], 'deleted': {}, 'next_segment': 0}
+        with open(self._manifest_path()) as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = self._manifest_path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._manifest_path())
+
+    def _load(self):
+        manifest = self._read_manifest()
+        self.manifest = manifest
+        self.segments = [
+            Segment(os.path.join(self.path, name), manifest['deleted'].get(name, ()))
+            for name in manifest['segments']
+        ]
+        self.live_docs = sum(segment.live_count for segment in self.segments)
+        live_length = sum(segment.live_length for segment in self.segments)
+        self.avgdl = live_length / self.live_docs if self.live_docs else 1.0
+        self._manifest_mtime = self._mtime()
+        with self._lock:
+            self._cache.clear()
+
+    def _mtime(self):
+        try:
+            return os.stat(self._manifest_path()).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def refresh(self):
+        """Pick up segments written by another process (e.g. the CLI)"""
+        if self._mtime() != self._manifest_mtime:
+            self._load()
+
+    @classmethod
+    def build(cls, path, documents):
+        """Create a new index at path from documents, replacing any existing one.
+
+        The index is written to a temporary directory and swapped into place,
+        so readers of the old index never see it half-deleted.
+        """
+        path = os.path.normpath(path)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        cls(tmp_path).add(documents)
+
+        old_path = None
+        if os.path.exists(path):
+            # Open mmaps of the old segments stay valid after the rename
+            old_path = f"{path}.old-{os.getpid()}"
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        if old_path:
+            shutil.rmtree(old_path, ignore_errors=True)
+        return cls(path)
+
+    def add(self, documents):
+        """Index documents in a new segment; documents whose id already exists replace it"""
+        documents = list(documents)
+        if not documents:
+            return 0
+        manifest = self._read_manifest()
+        self._delete_ids(manifest, [doc['id'] for doc in documents])
+
+        name = f"seg-{manifest['next_segment']:05d}"
+        write_segment(os.path.join(self.path, name), documents)
+        manifest['segments'].append(name)
+        manifest['next_segment'] += 1
+        self._write_manifest(manifest)
+        self._load()
+        return len(documents)
+
+    def delete(self, doc_ids):
+        manifest = self._read_manifest()
+        removed = self._delete_ids(manifest, doc_ids)
+        self._write_manifest(manifest)
+        self._load()
+        return removed
+
+    def _delete_ids(self, manifest, doc_ids):
+        removed = 0
+        if not doc_ids:
+            return removed
+        for segment in self.segments:
+            deleted = set(manifest['deleted'].get(segment.name, ()))
+            before = len(deleted)
+            deleted.update(segment.find(doc_ids))
+            if len(deleted) != before:
+                manifest['deleted'][segment.name] = sorted(deleted)
+                removed += len(deleted) - before
+        return removed
+
+    def documents(self):
+        """Iterate the live documents of every segment"""
+        for segment in self.segments:
+            deleted = set(segment.deleted.tolist())
+            for i in range(segment.size):
+                if i not in deleted:
+                    yield segment.document(i)
+
+    def compact(self):
+        """Rewrite all live documents into a single segment"""
+        manifest = self._read_manifest()
+        old_segments = list(manifest['segments'])
+        name = f"seg-{manifest['next_segment']:05d}"
+        write_segment(os.path.join(self.path, name), list(self.documents()))
+        self._write_manifest({'segments': [name], 'deleted': {}, 'next_segment': manifest['next_segment'] + 1})
+        self._load()
+        for old in old_segments:
+            # Readers that still have these mapped keep working until they refresh
+            shutil.rmtree(os.path.join(self.path, old), ignore_errors=True)
+
+    # Search
+
+    def search(self, query, k=10):
+        """Top-k [(score, document)] for a free-text query"""
+        self.refresh()
+        terms = Counter(tokenize(query))
+        if not terms or not self.live_docs:
+            return []
+
+        key = (tuple(sorted(terms.items())), k)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        results = self._search(terms, k)
+
+        with self._lock:
+            self._cache[key] = results
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return results
+
+    def _search(self, terms, k):
+        # Collection-wide document frequencies of live documents, summed across
+        # segments, so incremental updates score the same as a full rebuild
+        positions = {}
+        df = Counter()
+        for term in terms:
+            encoded = term.encode('utf-8')
+            for s, segment in enumerate(self.segments):
+                position = segment.lookup(encoded)
+                if position >= 0:
+                    positions[term, s] = position
+                    df[term] += segment.live_df(position)
+
+        n = self.live_docs
+        idf = {term: math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5)) for term in df}
+
+        hits = []
+        for s, segment in enumerate(self.segments):
+            term_weights = [
+                (positions[term, s], idf[term] * count)
+                for term, count in terms.items() if (term, s) in positions
+            ]
+            scores, docs = segment.score(term_weights, self.avgdl, k)
+            hits.extend(zip(scores.tolist(), [s] * len(docs), docs.tolist()))
+
+        hits.sort(key=lambda hit: -hit[0])
+        return [(score, self.segments[s].document(i)) for score, s, i in hits[:k]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the knowledge retrieval index")
+    parser.add_argument('command', choices=['build', 'add', 'delete', 'compact', 'search'])
+    parser.add_argument('arg', nargs='?', help="Corpus file (build/add), comma-separated ids (delete) or query (search)")
+    parser.add_argument('--index', default='knowledge/index')
+    parser.add_argument('-k', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        index = RetrievalIndex.build(args.index, load_corpus(args.arg))
+        print(f"Built index with {index.live_docs} documents at {args.index}")
+    elif args.command == 'add':
+        index = RetrievalIndex(args.index)
+        print(f"Added {index.add(load_corpus(args.arg))} documents")
+    elif args.command == 'delete':
+        index = RetrievalIndex(args.index)
+        print(f"Deleted {index.delete(args.arg.split(','))} documents")
+    elif args.command == 'compact':
+        index = RetrievalIndex(args.index)
+        index.compact()
+        print(f"Compacted index to one segment of {index.live_docs} documents")
+    else:
+        for score, doc in RetrievalIndex(args.index).search(args.arg, k=args.k):
+            print(f"{score:7.3f}  {doc.get('title')}")
+
+
+if __name__ == '__main__':
+    main()
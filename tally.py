@@ -0,0 +1,149 @@
+"""
+Tally form schema and the mapping from webhook payloads to intake columns.
+
+Shared by the webhook handler and the offline tools, so every path that
+turns a Tally submission into a comprehensive_intake row maps it the same way.
+"""
+
+from datetime import datetime
+
+from records import IntakeRecord
+
+# Hidden field carrying our user id into the form
+USER_ID_FIELD_KEY = 'question_bdVV96_173643ff-973c-4990-b125-0fe255b0ab67'
+
+# comprehensive_intake column -> Tally question key
+INTAKE_QUESTION_KEYS = {
+    'preferred_name': 'question_d9ONWo',
+    'birthday': 'question_Y41R5B',
+    'location': 'question_D7jK4R',
+    'biological_sex': 'question_l6xqbk',
+    'goals': 'question_RDAdG9',
+    'chronic_conditions': 'question_o2qDbP',
+    'medications_supplements': 'question_GRZKxZ',
+    'pregnancy_status': 'question_O76lDR',
+    'has_menstrual_cycle': 'question_VzKjLg',
+    'menstrual_symptoms': 'question_Pz7DdV',
+    'bowel_movement_frequency': 'question_Ex25k4',
+    'bowel_movement_type': 'question_roeBjN',
+    'digestive_symptoms': 'question_4KMBaX',
+    'other_symptoms': 'question_jljbea',
+    'body_temperature': 'question_2KpBjj',
+    'nervous_system_signals': 'question_xJAjVr',
+    'energy_pattern': 'question_RDAdWd',
+    'sleep_pattern': 'question_o2qD9e',
+    'movement_level': 'question_GRZKep',
+    'appetite_pattern': 'question_O76lQ7',
+    'diet_type': 'question_VzKjpJ',
+    'food_allergies': 'question_Pz7DR5',
+    'emotional_patterns': 'question_Ex25qX',
+    'birth_history': 'question_roeBDl',
+    'past_medications': 'question_4KMBak',
+    'significant_history': 'question_jljbex',
+}
+
+# comprehensive_intake column -> question title, as shown in the form and
+# used for the column headers of Tally's CSV export
+INTAKE_QUESTION_LABELS = {
+    'preferred_name': "First things first, what would you like us to call you?",
+    'birthday': "When's your birthday?",
+    'location': "Where are you living?",
+    'biological_sex': "What's your biological sex?",
+    'goals': "What do you hope to get out of Ruta?",
+    'chronic_conditions': "Do you have any chronic conditions?",
+    'medications_supplements': "Are you taking any meds or supplements?",
+    'pregnancy_status': "Are you pregnant, breastfeeding, or planning to be?",
+    'has_menstrual_cycle': "Do you have a menstrual cycle?",
+    'menstrual_symptoms': "Do you experience any of the following related to your menstrual cycle?",
+    'bowel_movement_frequency': "How often do you have a bowel movement?",
+    'bowel_movement_type': "How would you describe your bowel movements?",
+    'digestive_symptoms': "Do you notice any of the following related to your digestion?",
+    'other_symptoms': "Do you experience any other symptoms?",
+    'body_temperature': "How does your body temperature run?",
+    'nervous_system_signals': "Do you notice any of these nervous system signals?",
+    'energy_pattern': "How's your energy throughout the day?",
+    'sleep_pattern': "How's your sleep?",
+    'movement_level': "What does your daily movement look like?",
+    'appetite_pattern': "How's your appetite lately?",
+    'diet_type': "Do you eat according to a specific diet?",
+    'food_allergies': "Do you have any food allergies or intolerances?",
+    'emotional_patterns': "Do you experience any of these emotional or stress patterns?",
+    'birth_history': "What's your birth history?",
+    'past_medications': "Have you ever taken any of these in the past?",
+    'significant_history': "Do you have a history of any of the following?",
+}
+
+# Columns filled in from a submission, in the order map_intake_data sets them
+MAPPED_COLUMNS = ('user_id',) + tuple(INTAKE_QUESTION_KEYS) + ('updated_at',)
+
+
+def find_user_id(tally_data):
+    """Return the user id from the hidden field of a webhook payload"""
+    for field in tally_data.get('data', {}).get('fields', []):
+        if field.get('key') == USER_ID_FIELD_KEY:
+            return field.get('value')
+    return None
+
+
+def extract_fields(tally_data):
+    """Build a dictionary mapping field keys to their values.
+
+    Choice answers arrive as lists of option ids; they are mapped to the
+    selected option texts (a single string when only one was selected).
+    """
+    fields_array = tally_data.get('data', {}).get('fields', [])
+    fields_dict = {}
+
+    if isinstance(fields_array, list):
+        for field in fields_array:
+            key = field.get('key')
+            value = field.get('value')
+
+            if key:
+                # Handle multiple choice - extract the selected option text
+                if isinstance(value, list) and len(value) > 0:
+                    selected_ids = value
+
+                    # Map selected IDs to their text values
+                    selected_texts = []
+                    for opt in field.get('options', []):
+                        if opt.get('id') in selected_ids:
+                            selected_texts.append(opt.get('text'))
+
+                    fields_dict[key] = selected_texts if len(selected_texts) > 1 else (selected_texts[0] if selected_texts else None)
+                else:
+                    fields_dict[key] = value
+
+    return fields_dict
+
+
+def map_intake_data(user_id, fields_dict, columns=None):
+    """Map extracted Tally fields onto a comprehensive_intake record.
+
+    With columns, only those intake columns are set (e.g. the questions a CSV
+    export actually contains), so the record never overwrites the others.
+    """
+    if columns is None:
+        mapped_columns = MAPPED_COLUMNS
+    else:
+        mapped_columns = ('user_id',) + tuple(c for c in INTAKE_QUESTION_KEYS if c in columns) + ('updated_at',)
+    values = [user_id]
+    values.extend(fields_dict.get(INTAKE_QUESTION_KEYS[column]) for column in mapped_columns[1:-1])
+    values.append(datetime.utcnow().isoformat())
+    return IntakeRecord.from_values(mapped_columns, values)
+
+
+def option_schema(tally_data):
+    """Return {column: [option texts]} for every choice question in a payload.
+
+    Any webhook payload carries the full option list of each choice question,
+    so a single saved payload is enough to describe the form.
+    """
+    columns_by_key = {key: column for column, key in INTAKE_QUESTION_KEYS.items()}
+    schema = {}
+    for field in tally_data.get('data', {}).get('fields', []):
+        column = columns_by_key.get(field.get('key'))
+        options = field.get('options')
+        if column and options:
+            schema[column] = [opt.get('text') for opt in options]
+    return schema